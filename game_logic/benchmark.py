@@ -0,0 +1,129 @@
+"""
+Search benchmark: fixed positions searched to fixed depths by a fresh Engine, so node counts
+repeat exactly between runs and nodes/s and time to depth can be compared across commits.
+
+    python benchmark.py                          # default depth, table on stdout
+    python benchmark.py -d 5 --json run.json --csv run.csv
+    python benchmark.py --compare base.json      # nodes and speed against an earlier run
+"""
+import argparse
+import csv
+import json
+import platform
+import subprocess
+import time
+from typing import Dict, List, Optional, Tuple
+from engine import Engine
+from supports import EvaluateSet
+from fen import parse_fen, START_FEN
+
+# name: (phase, FEN); "opening" is the Game.initialize_pieces setup
+POSITIONS: Dict[str, Tuple[str, str]] = {
+    "opening": ("opening", START_FEN),
+    "central_cannon": ("middlegame", "2bakab1r/r8/1cn1c1n2/p1p1p3p/6p2/2P4C1/P3P1P1P/2N1C1N2/8R/1RBAKAB2 b - - 0 1"),
+    "open_files": ("middlegame", "2b2k3/1r2a4/4b1ncr/3R4p/2p3P2/1C2P4/P1N6/4B4/4A4/4KA1R1 w - - 0 1"),
+    "chariot_horse_vs_chariot": ("endgame", "3k5/4a2r1/4b4/2P6/5N3/R8/9/9/4A4/4K4 w - - 0 1"),
+    "soldiers_race": ("endgame", "4k4/4a4/3P5/7n1/6P2/9/1p7/5p3/9/2B2K3 b - - 0 1"),
+}
+
+DEFAULT_DEPTH = 5
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_position(name: str, depth: int, eval_set: EvaluateSet, hash_mb: float) -> dict:
+    """Searches one position with a fresh engine, returns its result record"""
+    phase, fen = POSITIONS[name]
+    board, color = parse_fen(fen)
+    engine = Engine(eval_set, depth=depth, hash_mb=hash_mb)
+    start = time.perf_counter()
+    value, move = engine.get_best_move(board, color)
+    elapsed = time.perf_counter() - start
+    nodes = engine.nodes + engine.qnodes
+    return {
+        "position": name,
+        "phase": phase,
+        "depth": depth,
+        "nodes": engine.nodes,
+        "qnodes": engine.qnodes,
+        "seconds": round(elapsed, 4),
+        "nps": round(nodes / elapsed) if elapsed else 0,
+        "best_move": f"{move[0].x},{move[0].y} to {move[1].x},{move[1].y}" if move else None,
+        "score": value,
+        # seconds until each iteration completed
+        "time_to_depth": {str(d): round(seconds, 4) for d, seconds, _, _, _ in engine.iterations},
+    }
+
+def run(names: List[str], depth: int, eval_set: EvaluateSet, hash_mb: float = 16) -> dict:
+    results = []
+    for name in names:
+        record = run_position(name, depth, eval_set, hash_mb)
+        results.append(record)
+        print(f"{name:26} {record['phase']:11} depth {depth} {record['nodes'] + record['qnodes']:>9} nodes "
+              f"{record['seconds']:8.3f}s {record['nps']:>8} n/s  {record['best_move']}  {record['score']}")
+    nodes = sum(record["nodes"] + record["qnodes"] for record in results)
+    seconds = sum(record["seconds"] for record in results)
+    print(f"{'total':26} {'':11} depth {depth} {nodes:>9} nodes {seconds:8.3f}s {round(nodes / seconds) if seconds else 0:>8} n/s")
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "eval_set": list(eval_set.get()),
+        "depth": depth,
+        "total_nodes": nodes,
+        "total_seconds": round(seconds, 4),
+        "nps": round(nodes / seconds) if seconds else 0,
+        "positions": results,
+    }
+
+def write_csv(path: str, report: dict):
+    fields = ["commit", "position", "phase", "depth", "nodes", "qnodes", "seconds", "nps", "best_move", "score",
+              "time_to_depth"]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for record in report["positions"]:
+            row = dict(record, commit=report["commit"])
+            row["time_to_depth"] = " ".join(f"{d}:{s}" for d, s in record["time_to_depth"].items())
+            writer.writerow(row)
+
+def compare(report: dict, path: str):
+    """Prints node count and speed of this run against an earlier JSON report"""
+    with open(path) as f:
+        base = json.load(f)
+    base_positions = {(record["position"], record["depth"]): record for record in base["positions"]}
+    print(f"against {base.get('commit')} ({path}):")
+    for record in report["positions"]:
+        old = base_positions.get((record["position"], record["depth"]))
+        if old is None:
+            continue
+        nodes = record["nodes"] + record["qnodes"]
+        old_nodes = old["nodes"] + old["qnodes"]
+        print(f"{record['position']:26} nodes {old_nodes:>9} -> {nodes:<9} time x{record['seconds'] / old['seconds'] if old['seconds'] else 0:.2f}"
+              f"{'' if record['best_move'] == old['best_move'] else '  best move changed'}")
+    same_run = [(r["position"], r["depth"]) for r in report["positions"]] == list(base_positions)
+    if same_run and base.get("total_seconds"):
+        print(f"{'total':26} time x{report['total_seconds'] / base['total_seconds']:.2f}, n/s {base['nps']} -> {report['nps']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search benchmark of Engine.get_best_move")
+    parser.add_argument("-d", "--depth", type=int, default=DEFAULT_DEPTH)
+    parser.add_argument("-p", "--position", action="append", choices=sorted(POSITIONS),
+                        help="positions to search, all by default")
+    parser.add_argument("--hash-mb", type=float, default=16)
+    parser.add_argument("--json", help="write the report as JSON")
+    parser.add_argument("--csv", help="write one row per position as CSV")
+    parser.add_argument("--compare", help="JSON report of an earlier run")
+    args = parser.parse_args()
+    report = run(args.position or list(POSITIONS), args.depth, EvaluateSet(), args.hash_mb)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.csv:
+        write_csv(args.csv, report)
+    if args.compare:
+        compare(report, args.compare)
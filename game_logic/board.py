@@ -1,306 +1,780 @@
-from pieces import Piece, General, Soldier
-from typing import List, Optional, Callable, Tuple
-from supports import Vector, Color, textcolors, FULLBOARD_AREA, RED_PALACE_AREA, BLACK_PALACE_AREA, EvaluateSet, Square_status
+from pieces import Piece
+from typing import List, Optional, Callable
+from supports import (Vector, Color, textcolors, FULLBOARD_AREA, EvaluateSet, Square_status,
+                      BOARD_WIDTH, BOARD_HEIGHT, BOARD_SIZE, SQUARE_VECTORS, square_of,
+                      EMPTY, GENERAL, ELEPHANT, HORSE, CHARIOT, CANNON, SOLDIER)
+from zobrist import PIECE_KEYS
+from evaluation import PIECE_SQUARE
+from move_tables import (LEAPER_MOVES, HORSE_CHECKS, RANK_SLIDES, FILE_SLIDES, RANK_SQUARES, FILE_SQUARES,
+                         SQUARE_X, SQUARE_Y, SLIDE_EMPTY, SLIDE_BLOCKERS, SLIDE_SCREENED, SLIDE_BEHIND)
 from math import inf
 
-class Square:
-    def __init__(self, position: Vector):
-        self.position = position
-        self.piece: Optional['Piece'] = None
-        self.state = Square_status.neutral
-        self.red_attacks: int = 0
-        self.black_attacks: int = 0
-
-    def reset_attacks(self):
-        self.red_attacks = 0
-        self.black_attacks = 0
-        self.state = Square_status.neutral
-
-    def add_attack(self, color: Color):
-        if color == Color.RED:
-            self.red_attacks += 1
-        else:
-            self.black_attacks += 1
-        self.update_state()
-    
-    def remove_attack(self, color: Color):
-        if color == Color.RED:
-            self.red_attacks -= 1
-        else:
-            self.black_attacks -= 1
-        self.update_state()
-
-    def update_state(self):
-        if self.red_attacks > self.black_attacks:
-            self.state = Square_status.red
-        elif self.black_attacks > self.red_attacks:
-            self.state = Square_status.black
-        else:
-            self.state = Square_status.neutral
-
-    def get_state(self):
-        return self.state
-
-    def get_piece(self):
-        return self.piece
-
-    def remove_piece(self):
-        self.piece = None
-
-    def set_piece(self, piece: Piece):
-        old_piece = self.piece
-        self.piece = piece
-        piece.set_position(self.position)
-        return old_piece
+ORTHOGONAL = ((1, 0), (-1, 0), (0, 1), (0, -1))
+DIAGONAL = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+def _neighbours(square: int, steps) -> List[int]:
+    x = square % BOARD_WIDTH
+    y = square // BOARD_WIDTH
+    return [(y + dy) * BOARD_WIDTH + x + dx for dx, dy in steps
+            if 0 <= x + dx < BOARD_WIDTH and 0 <= y + dy < BOARD_HEIGHT]
+
+# Squares whose occupancy can change what the piece on a given square controls:
+# horses are blocked by an orthogonal neighbour, elephants by a diagonal one,
+# chariots and cannons by anything on their rank or file
+ORTHOGONAL_NEIGHBOURS = [_neighbours(square, ORTHOGONAL) for square in range(BOARD_SIZE)]
+DIAGONAL_NEIGHBOURS = [_neighbours(square, DIAGONAL) for square in range(BOARD_SIZE)]
+LINES = [[other for other in range(BOARD_SIZE) if other != square and
+          (other % BOARD_WIDTH == square % BOARD_WIDTH or other // BOARD_WIDTH == square // BOARD_WIDTH)]
+         for square in range(BOARD_SIZE)]
+
+class UndoEntry:
+    """Everything make_move changes, so unmake_move restores it without recomputation"""
+    __slots__ = ('from_sq', 'to_sq', 'captured', 'slot', 'uncapturing_moves_count', 'hash',
+                 'mover_attacks', 'captured_attacks', 'refreshed_squares', 'refreshed_attacks')
+
+    def __init__(self):
+        self.from_sq = 0
+        self.to_sq = 0
+        self.captured: Optional[Piece] = None
+        self.slot = -1
+        self.uncapturing_moves_count = 0
+        self.hash = 0
+        self.mover_attacks: Optional[List[int]] = None
+        self.captured_attacks: Optional[List[int]] = None
+        # pieces whose control was recomputed by the move, with their previous control lists
+        self.refreshed_squares: List[int] = []
+        self.refreshed_attacks: List[List[int]] = []
 
 class Board:
     def __init__(self, debug=False):
-        self.squares = [[Square(Vector(x, y)) for y in range(10)] for x in range(9)]
+        # piece code per square (see supports), and the Piece object standing on it
+        self.cells: List[int] = [EMPTY] * BOARD_SIZE
+        self.pieces: List[Optional[Piece]] = [None] * BOARD_SIZE
+        self.red_control: List[int] = [0] * BOARD_SIZE
+        self.black_control: List[int] = [0] * BOARD_SIZE
+        # Evaluation terms kept up to date by add_piece/move_piece, index 0 = RED, 1 = BLACK
+        self.material = [0, 0]
+        self.attacker_count = [0, 0]
+        self.mobility = [0, 0]
+        self.position_score = [0, 0]
+        # squares controlled by the piece standing on each square
+        self.attacks: List[Optional[List[int]]] = [None] * BOARD_SIZE
+        # sums of the square control states (+1 RED, -1 BLACK) over all and over occupied squares
+        self.control_balance = 0
+        self.control_occupied = 0
+        # number of pieces on the board per signed piece code (index code + SOLDIER)
+        self.counts = [0] * (2 * SOLDIER + 1)
+        # occupancy bitmasks: bit x of rank_occupancy[y], bit y of file_occupancy[x]
+        self.rank_occupancy = [0] * BOARD_HEIGHT
+        self.file_occupancy = [0] * BOARD_WIDTH
+        # Zobrist key of the placement, updated incrementally (see zobrist)
+        self.hash = 0
         self.evaluation = 0
-        self.history = []
+        # squares of the RED and BLACK generals, -1 while one is off the board
+        self.general_squares = [-1, -1]
+        # packed moves played on the board (see supports)
+        self.history: List[int] = []
+        # plies played before the position the board was set up from (fen), for move numbers
+        self.initial_plies = 0
         self.uncapturing_moves_count = 0
-        self.save_UMC = self.uncapturing_moves_count
+        # reused undo records, one per ply reached so far; ply = number of moves currently made.
+        # undo_stack[i].hash is the key of the position at ply i, repetitions() looks positions up there
+        self.undo_stack: List[UndoEntry] = []
+        self.ply = 0
+        # scratch list of _refresh_lines, reused by every move
+        self.refresh_buffer: List[int] = []
         self.reds = []
         self.blacks = []
         self.debug = debug
 
+    def __getstate__(self):
+        # only the position keys repetitions() reads are pickled, not the undo records,
+        # so an unpickled board cannot take back the moves played before
+        state = self.__dict__.copy()
+        state["undo_stack"] = [entry.hash for entry in self.undo_stack[:self.ply]]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.undo_stack = []
+        for key in state["undo_stack"]:
+            entry = UndoEntry()
+            entry.hash = key
+            self.undo_stack.append(entry)
+
     def add_piece(self, piece: Piece):
-        position = piece.get_position()
-        square = self.get_square(position)
-        if square and square.get_piece():
-            raise ValueError(f"Square {position} is already occupied by {square.piece}")
-        else:
-            square.set_piece(piece)
-        if piece.color == Color.RED:
-            self.reds.append(piece)
-        else:
-            self.blacks.append(piece)
+        square = piece.get_square()
+        if self.pieces[square] is not None:
+            raise ValueError(f"Square {piece.get_position()} is already occupied by {self.pieces[square]}")
+        code = piece.get_code()
+        self.pieces[square] = piece
+        self.cells[square] = code
+        self.hash ^= PIECE_KEYS[code + SOLDIER][square]
+        self.rank_occupancy[SQUARE_Y[square]] |= 1 << SQUARE_X[square]
+        self.file_occupancy[SQUARE_X[square]] |= 1 << SQUARE_Y[square]
+        if code == GENERAL or code == -GENERAL:
+            self.general_squares[0 if code > 0 else 1] = square
+        team = self.reds if piece.color == Color.RED else self.blacks
+        piece.slot = len(team)
+        team.append(piece)
+        self.control_occupied += self._control_sign(square)
+        self._drop_eval(square)
+        self._refresh_lines(None, square)
+
+    def set_up(self, pieces: List[Piece]):
+        """Puts pieces on an empty board, the evaluation is computed once all of them stand"""
+        if self.reds or self.blacks:
+            raise ValueError("set_up needs an empty board")
+        for piece in pieces:
+            square = piece.get_square()
+            if self.pieces[square] is not None:
+                raise ValueError(f"Square {piece.get_position()} is already occupied by {self.pieces[square]}")
+            code = piece.get_code()
+            self.pieces[square] = piece
+            self.cells[square] = code
+            self.hash ^= PIECE_KEYS[code + SOLDIER][square]
+            self.rank_occupancy[SQUARE_Y[square]] |= 1 << SQUARE_X[square]
+            self.file_occupancy[SQUARE_X[square]] |= 1 << SQUARE_Y[square]
+            if code == GENERAL or code == -GENERAL:
+                self.general_squares[0 if code > 0 else 1] = square
+            team = self.reds if piece.color == Color.RED else self.blacks
+            piece.slot = len(team)
+            team.append(piece)
+        for piece in pieces:
+            self._drop_eval(piece.square)
 
     def history_by_index(self, index):
         return self.history[-index]
 
-    def remove_piece(self, piece: Optional['Piece']):
-        if piece.color == Color.RED:
-            self.reds.remove(piece)
+    def remove_piece(self, piece: Optional['Piece']) -> int:
+        """Takes piece out of its team list in O(1), the last piece fills its slot. Returns the slot"""
+        team = self.reds if piece.color == Color.RED else self.blacks
+        slot = piece.slot
+        last = team.pop()
+        if last is not piece:
+            team[slot] = last
+            last.slot = slot
+        return slot
+
+    def restore_piece(self, piece: Piece, slot: int):
+        """Exact inverse of remove_piece"""
+        team = self.reds if piece.color == Color.RED else self.blacks
+        if slot < len(team):
+            moved = team[slot]
+            moved.slot = len(team)
+            team.append(moved)
+            team[slot] = piece
         else:
-            self.blacks.remove(piece)
+            team.append(piece)
+        piece.slot = slot
 
-    def get_square(self, position: Vector, area:Optional[tuple]=None):
-        """
-        params: area: part of the board to check if square is in this area
-                None means area checking is not needed 
-        """
-        if area and not(position.in_area(area)):
+    def get_piece_at(self, square: int) -> Optional[Piece]:
+        return self.pieces[square]
+
+    def get_piece(self, position: Vector) -> Optional[Piece]:
+        if not position.in_area(FULLBOARD_AREA):
             return None
-        return self.squares[position.x][position.y]
+        return self.pieces[square_of(position)]
 
     def get_uncapturing_moves_count(self):
         return self.uncapturing_moves_count
 
-    # returns the square of piece, giving check
-    # if is not in check, returns None
-    def is_in_check(self, color: Color):
-        #General sight
-        gen_red = None
-        gen_black = None
-        for piece in self.reds:
-            if isinstance(piece, General):
-                gen_red = piece
-        for piece in self.blacks:
-            if isinstance(piece, General):
-                gen_black = piece
-        if gen_black and gen_red:
-            x = gen_red.get_position().getX()
-            if (x == gen_black.get_position().getX()) and self.empty_between_general(x, gen_red.get_position().getY(), gen_black.get_position().getY()):
-                return (gen_red, Vector(x,10)) if color == Color.BLACK else (gen_black, Vector(x,10))
-
-        #Move repeatition
-        # 3-time repetition causes mate
-        if len(self.history) > 5:
-            repeated3 = True
-            for i in range(1,4):
-                if self.history[-i] != self.history[-i-4]:
-                    repeated3 = False
-                    break
-            if repeated3:
-                print("REPEATED")
-                return (self.get_square(self.history[-1][1]).get_piece(), self.history[-1])
-
-        #Checks
-        opponent_pieces = self.reds if color == Color.BLACK else self.blacks
-        palace = RED_PALACE_AREA if color == Color.RED else BLACK_PALACE_AREA
-        attackers = [attacker for attacker in opponent_pieces if attacker.is_attacker()]
-        for attacker in attackers:
-            attackers_valid_moves = self.get_piece_valid_moves(attacker, check=False)
-            for move in attackers_valid_moves:
-                square = self.get_square(move, area=palace)
-                if square and square.piece and isinstance(square.piece, General):
-                    return (attacker, move)
-        
-        return (None,None)
+    def find_general(self, color: Color) -> Optional[Piece]:
+        square = self.general_squares[0 if color == Color.RED else 1]
+        return self.pieces[square] if square >= 0 else None
 
-    def empty_between_general(self, x, y1, y2):
-        for j in range(y1+1, y2):
-            if self.squares[x][j].get_piece():
-                return False
-        return True
+    # returns the piece, giving check, and the square it attacks
+    # if is not in check, returns (None, None)
+    def is_in_check(self, color: Color):
+        target = self.general_squares[0 if color == Color.RED else 1]
+        if target < 0:
+            return (None, None)
+        attacker = self.attacker_square(target, color != Color.RED)
+        if attacker < 0:
+            return (None, None)
+        return (self.pieces[attacker], SQUARE_VECTORS[target])
 
     def get_attackers(self, color: Color) -> List[Piece]:
         return [piece for piece in (self.reds if color == Color.RED else self.blacks) if piece.is_attacker()]
-    
-    def move_piece(self, from_pos: Vector, to_pos: Vector, set_instead : Optional['Piece'] = None, returning = False):
-        old_square = self.squares[from_pos.getX()][from_pos.getY()]
-        the_piece = old_square.get_piece()
+
+    def move_piece(self, from_sq: int, to_sq: int) -> Optional[Piece]:
+        """Plays a game move, returns the captured piece"""
+        return self.make_move(from_sq, to_sq)
+
+    def make_move(self, from_sq: int, to_sq: int) -> Optional[Piece]:
+        pieces = self.pieces
+        cells = self.cells
+        the_piece = pieces[from_sq]
         if the_piece is None:
-            raise ValueError("There is no piece on " + from_pos)
-        the_piece.set_position(to_pos)
-        taken = self.squares[to_pos.getX()][to_pos.getY()].set_piece(the_piece)
-        if taken is not None:
-            #capturing
-            self.remove_piece(taken)
-            self.save_UMC = self.uncapturing_moves_count
-            self.uncapturing_moves_count = 0
+            raise ValueError(f"There is no piece on {SQUARE_VECTORS[from_sq]}")
+        if self.ply == len(self.undo_stack):
+            self.undo_stack.append(UndoEntry())
+        entry = self.undo_stack[self.ply]
+        self.ply += 1
+        entry.from_sq = from_sq
+        entry.to_sq = to_sq
+        entry.uncapturing_moves_count = self.uncapturing_moves_count
+        entry.hash = self.hash
+
+        taken = pieces[to_sq]
+        entry.captured = taken
+        entry.mover_attacks = self.attacks[from_sq]
+        self._lift_eval(from_sq)
+        code = cells[from_sq]
+        keys = PIECE_KEYS[code + SOLDIER]
+        if code == GENERAL or code == -GENERAL:
+            self.general_squares[0 if code > 0 else 1] = to_sq
+        if taken is None:
+            self.hash ^= keys[from_sq] ^ keys[to_sq]
         else:
+            #capturing
+            if cells[to_sq] == GENERAL or cells[to_sq] == -GENERAL:
+                self.general_squares[0 if cells[to_sq] > 0 else 1] = -1
+            entry.captured_attacks = self.attacks[to_sq]
+            self._lift_eval(to_sq)
+            entry.slot = self.remove_piece(taken)
+            self.hash ^= keys[from_sq] ^ keys[to_sq] ^ PIECE_KEYS[cells[to_sq] + SOLDIER][to_sq]
+        pieces[to_sq] = the_piece
+        cells[to_sq] = code
+        pieces[from_sq] = None
+        cells[from_sq] = EMPTY
+        the_piece.square = to_sq
+        from_x = SQUARE_X[from_sq]
+        from_y = SQUARE_Y[from_sq]
+        self.rank_occupancy[from_y] ^= 1 << from_x
+        self.file_occupancy[from_x] ^= 1 << from_y
+        if taken is None:
+            to_x = SQUARE_X[to_sq]
+            to_y = SQUARE_Y[to_sq]
+            self.rank_occupancy[to_y] |= 1 << to_x
+            self.file_occupancy[to_x] |= 1 << to_y
+        self.control_occupied -= self._control_sign(from_sq)
+        if taken is None:
+            self.control_occupied += self._control_sign(to_sq)
             self.uncapturing_moves_count += 1
-
-        old_square.remove_piece()
-
-        if returning:
-            self.history.pop()
-            self.uncapturing_moves_count -= 2
         else:
-            self.history.append([from_pos, to_pos])
+            self.uncapturing_moves_count = 0
+        self._drop_eval(to_sq)
+        self._refresh_lines(entry, from_sq, to_sq)
+        self.history.append((from_sq << 7) | to_sq)
+        return taken
 
-        if set_instead is not None:
-            #set captured => cancel capturing
-            self.add_piece(set_instead)
-            self.uncapturing_moves_count = self.save_UMC
+    def make_null_move(self):
+        """
+        Passes the turn for null move pruning, the board stays the same, only a ply is taken.
+        Positions before the pass do not count as repetitions after it.
+        """
+        if self.ply == len(self.undo_stack):
+            self.undo_stack.append(UndoEntry())
+        entry = self.undo_stack[self.ply]
+        entry.from_sq = -1
+        entry.hash = self.hash
+        entry.uncapturing_moves_count = self.uncapturing_moves_count
+        self.uncapturing_moves_count = 0
+        self.ply += 1
 
-        return taken
+    def unmake_null_move(self):
+        self.ply -= 1
+        self.uncapturing_moves_count = self.undo_stack[self.ply].uncapturing_moves_count
 
-    def ghost_test(self, from_pos:Vector, to_pos:Vector, func: Callable):
-        taken = self.move_piece(from_pos, to_pos)
+    def repetitions(self) -> int:
+        """
+        Times the current position, with the same side to move, stood on the board before,
+        looked up by hash among the positions since the last capture
+        """
+        ply = self.ply
+        stack = self.undo_stack
+        key = self.hash
+        count = 0
+        for index in range(ply - 4, max(ply - self.uncapturing_moves_count, 0) - 1, -2):
+            if stack[index].hash == key:
+                count += 1
+        return count
+
+    def unmake_move(self):
+        """Takes back the last make_move or make_null_move"""
+        self.ply -= 1
+        entry = self.undo_stack[self.ply]
+        from_sq = entry.from_sq
+        if from_sq < 0:
+            self.uncapturing_moves_count = entry.uncapturing_moves_count
+            return
+        to_sq = entry.to_sq
+        pieces = self.pieces
+        cells = self.cells
+        attacks = self.attacks
+        mobility = self.mobility
+
+        refreshed_attacks = entry.refreshed_attacks
+        for i, square in enumerate(entry.refreshed_squares):
+            red = cells[square] > 0
+            old_targets = refreshed_attacks[i]
+            targets = attacks[square]
+            mobility[0 if red else 1] += len(old_targets) - len(targets)
+            self._remove_control(targets, red)
+            self._add_control(old_targets, red)
+            attacks[square] = old_targets
+
+        the_piece = pieces[to_sq]
+        self._lift_eval(to_sq)
+        captured = entry.captured
+        code = cells[to_sq]
+        pieces[from_sq] = the_piece
+        cells[from_sq] = code
+        the_piece.square = from_sq
+        if code == GENERAL or code == -GENERAL:
+            self.general_squares[0 if code > 0 else 1] = from_sq
+        from_x = SQUARE_X[from_sq]
+        from_y = SQUARE_Y[from_sq]
+        self.rank_occupancy[from_y] |= 1 << from_x
+        self.file_occupancy[from_x] |= 1 << from_y
+        if captured is None:
+            pieces[to_sq] = None
+            cells[to_sq] = EMPTY
+            to_x = SQUARE_X[to_sq]
+            to_y = SQUARE_Y[to_sq]
+            self.rank_occupancy[to_y] ^= 1 << to_x
+            self.file_occupancy[to_x] ^= 1 << to_y
+            self.control_occupied -= self._control_sign(to_sq)
+        else:
+            pieces[to_sq] = captured
+            code = captured.get_code()
+            cells[to_sq] = code
+            if code == GENERAL or code == -GENERAL:
+                self.general_squares[0 if code > 0 else 1] = to_sq
+        self.control_occupied += self._control_sign(from_sq)
+        self._drop_eval(from_sq, entry.mover_attacks)
+        if captured is not None:
+            self.restore_piece(captured, entry.slot)
+            self._drop_eval(to_sq, entry.captured_attacks)
+
+        self.hash = entry.hash
+        self.uncapturing_moves_count = entry.uncapturing_moves_count
+        self.history.pop()
+
+    def _lift_eval(self, square: int):
+        """Removes the evaluation terms of the piece on square, call before it leaves the square"""
+        piece = self.pieces[square]
+        code = self.cells[square]
+        red = code > 0
+        side = 0 if red else 1
+        self.material[side] -= piece.get_value()
+        if piece.is_attacker():
+            self.attacker_count[side] -= 1
+        self.position_score[side] -= PIECE_SQUARE[code + SOLDIER][square]
+        self.counts[code + SOLDIER] -= 1
+        targets = self.attacks[square]
+        self.attacks[square] = None
+        self.mobility[side] -= len(targets)
+        self._remove_control(targets, red)
+
+    def _drop_eval(self, square: int, targets: Optional[List[int]] = None):
+        """
+        Adds the evaluation terms of the piece that has just been put on square
+        params: targets: its control list when already known (unmake_move)
+        """
+        piece = self.pieces[square]
+        code = self.cells[square]
+        red = code > 0
+        side = 0 if red else 1
+        self.material[side] += piece.get_value()
+        if piece.is_attacker():
+            self.attacker_count[side] += 1
+        self.position_score[side] += PIECE_SQUARE[code + SOLDIER][square]
+        self.counts[code + SOLDIER] += 1
+        if targets is None:
+            targets = self.piece_targets(square, for_eval=True)
+        self.attacks[square] = targets
+        self.mobility[side] += len(targets)
+        self._add_control(targets, red)
+
+    def _refresh_lines(self, entry: Optional[UndoEntry], square: int, other_square: int = -1):
+        """
+        Recomputes control of the pieces whose lines pass through the changed squares
+        params: entry: undo record to save the replaced control lists in
+        """
+        cells = self.cells
+        affected = self.refresh_buffer
+        affected.clear()
+        for changed in (square, other_square):
+            if changed < 0:
+                continue
+            for other in LINES[changed]:
+                kind = cells[other]
+                if kind == CHARIOT or kind == CANNON or kind == -CHARIOT or kind == -CANNON:
+                    affected.append(other)
+            for other in ORTHOGONAL_NEIGHBOURS[changed]:
+                if cells[other] == HORSE or cells[other] == -HORSE:
+                    affected.append(other)
+            for other in DIAGONAL_NEIGHBOURS[changed]:
+                if cells[other] == ELEPHANT or cells[other] == -ELEPHANT:
+                    affected.append(other)
+        if entry is not None:
+            refreshed_squares = entry.refreshed_squares
+            refreshed_attacks = entry.refreshed_attacks
+            refreshed_squares.clear()
+            refreshed_attacks.clear()
+        attacks = self.attacks
+        for affected_square in affected:
+            if affected_square == square or affected_square == other_square:
+                continue
+            old_targets = attacks[affected_square]
+            if entry is not None:
+                if affected_square in refreshed_squares:
+                    continue
+                refreshed_squares.append(affected_square)
+                refreshed_attacks.append(old_targets)
+            red = cells[affected_square] > 0
+            targets = self.piece_targets(affected_square, for_eval=True)
+            attacks[affected_square] = targets
+            self.mobility[0 if red else 1] += len(targets) - len(old_targets)
+            self._remove_control(old_targets, red)
+            self._add_control(targets, red)
+
+    def _add_control(self, targets: List[int], red: bool):
+        red_control = self.red_control
+        black_control = self.black_control
+        cells = self.cells
+        balance = occupied = 0
+        if red:
+            for target in targets:
+                diff = red_control[target] - black_control[target]
+                red_control[target] += 1
+                if diff == 0 or diff == -1:
+                    balance += 1
+                    if cells[target]:
+                        occupied += 1
+        else:
+            for target in targets:
+                diff = red_control[target] - black_control[target]
+                black_control[target] += 1
+                if diff == 0 or diff == 1:
+                    balance -= 1
+                    if cells[target]:
+                        occupied -= 1
+        self.control_balance += balance
+        self.control_occupied += occupied
+
+    def _remove_control(self, targets: List[int], red: bool):
+        red_control = self.red_control
+        black_control = self.black_control
+        cells = self.cells
+        balance = occupied = 0
+        if red:
+            for target in targets:
+                diff = red_control[target] - black_control[target]
+                red_control[target] -= 1
+                if diff == 0 or diff == 1:
+                    balance -= 1
+                    if cells[target]:
+                        occupied -= 1
+        else:
+            for target in targets:
+                diff = red_control[target] - black_control[target]
+                black_control[target] -= 1
+                if diff == 0 or diff == -1:
+                    balance += 1
+                    if cells[target]:
+                        occupied += 1
+        self.control_balance += balance
+        self.control_occupied += occupied
+
+    def ghost_test(self, from_sq: int, to_sq: int, func: Callable):
+        self.make_move(from_sq, to_sq)
         result = func(self)
-        self.move_piece(to_pos, from_pos, set_instead=taken, returning=True)
+        self.unmake_move()
         return result
 
-    def get_piece_valid_moves(self, piece: Piece, check=True, for_eval=False):
-        valid_moves = []
-
-        if piece.can_modify() and (not piece.is_modified()):
-            if (piece.position.getY() > 4 if (piece.get_color() == Color.RED) else piece.get_position().getY() < 5):
-                piece.modify()
-        
-        move = piece.get_move()
-
-        for direction in move.get_directions():
-            
-            if move.is_bigstep() and self.has_piece(piece.get_position() + direction // 2):
+    def piece_targets(self, square: int, for_eval=False) -> List[int]:
+        """
+        Pseudo-legal destination squares of the piece on square.
+        params: for_eval: return controlled squares instead of moves:
+                squares of own pieces are included and cannons control squares behind the screen
+        """
+        cells = self.cells
+        code = cells[square]
+        red = code > 0
+        kind = code if red else -code
+        targets = []
+
+        if kind == CHARIOT or kind == CANNON:
+            x = SQUARE_X[square]
+            y = SQUARE_Y[square]
+            rank = RANK_SLIDES[x][self.rank_occupancy[y]]
+            file = FILE_SLIDES[y][self.file_occupancy[x]]
+            rank_squares = RANK_SQUARES[y]
+            file_squares = FILE_SQUARES[x]
+            if kind == CHARIOT:
+                quiet = SLIDE_EMPTY
+                hits = SLIDE_BLOCKERS
+            else:
+                quiet = SLIDE_BEHIND if for_eval else SLIDE_EMPTY
+                hits = SLIDE_SCREENED
+            targets = [rank_squares[position] for position in rank[quiet]]
+            targets += [file_squares[position] for position in file[quiet]]
+            for position in rank[hits]:
+                target_sq = rank_squares[position]
+                if for_eval or (cells[target_sq] > 0) != red:
+                    targets.append(target_sq)
+            for position in file[hits]:
+                target_sq = file_squares[position]
+                if for_eval or (cells[target_sq] > 0) != red:
+                    targets.append(target_sq)
+            return targets
+
+        for target_sq, block_sq in LEAPER_MOVES[code + SOLDIER][square]:
+            if block_sq >= 0 and cells[block_sq]:
                 continue
-
-            has_screen = False
-            position = piece.get_position()
-            for step in range(piece.get_max_steps()):
-                position += direction
-                target_square = self.get_square(position, area=piece.get_area())
-                if target_square is None:
-                    break
-                if target_square.get_piece():
-                    if (not piece.need_screen()) or has_screen:
-                        if for_eval or target_square.get_piece().get_color() != piece.get_color():
-                            if check:
-                                threat, killer_move = self.ghost_test(piece.get_position(), position,
-                                                                      lambda xxx: xxx.is_in_check(piece.get_color()))
-                                if threat is not None:
-                                    if self.debug:
-                                        print(f"Move by {piece} to {position} causes mate by {threat} with {killer_move}")
-                                    break     
-                            valid_moves.append(position)
-                        break
-                    else:
-                        has_screen = True
-                elif (has_screen == piece.need_screen()) if for_eval else (not has_screen):
-                    if check:
-                        threat, killer_move = self.ghost_test(piece.get_position(), position,
-                                                              lambda xxx: xxx.is_in_check(piece.get_color()))
-                        if threat is None:
-                            valid_moves.append(position)
-                        elif self.debug:
-                            print(f"BOT Move by {piece} to {position} causes mate by {threat} with {killer_move}")
-                    else:
-                        valid_moves.append(position)
-
-        if piece.can_modify() and piece.is_modified():
-            piece.set_default()
-
-        return valid_moves
-
+            target = cells[target_sq]
+            if (not target) or for_eval or (target > 0) != red:
+                targets.append(target_sq)
+        return targets
+
+    def is_legal(self, from_sq: int, to_sq: int, color: Color) -> bool:
+        self.make_move(from_sq, to_sq)
+        threat, killer_move = self.is_in_check(color)
+        self.unmake_move()
+        if threat is not None and self.debug:
+            print(f"Move by {self.pieces[from_sq]} to {SQUARE_VECTORS[to_sq]} causes mate by {threat} with {killer_move}")
+        return threat is None
+
+    def generate_moves(self, color: Color, check=False, piece: Optional[Piece] = None) -> List[int]:
+        """
+        All moves of color packed into ints (see supports).
+        params: check: only legal moves (see generate_legal_moves)
+                piece: only moves of this piece
+        """
+        if check:
+            return self.generate_legal_moves(color, piece)
+        moves = []
+        for piece in ((piece,) if piece is not None else (self.reds if color == Color.RED else self.blacks)):
+            from_sq = piece.square
+            for to_sq in self.piece_targets(from_sq):
+                moves.append((from_sq << 7) | to_sq)
+        return moves
+
+    def generate_captures(self, color: Color) -> List[int]:
+        """Pseudo-legal captures of color, packed; sliders read only the pieces their lines end on"""
+        cells = self.cells
+        rank_occupancy = self.rank_occupancy
+        file_occupancy = self.file_occupancy
+        red = color == Color.RED
+        captures = []
+        for piece in (self.reds if red else self.blacks):
+            from_sq = piece.square
+            code = cells[from_sq]
+            kind = code if red else -code
+            if kind == CHARIOT or kind == CANNON:
+                x = SQUARE_X[from_sq]
+                y = SQUARE_Y[from_sq]
+                hits = SLIDE_BLOCKERS if kind == CHARIOT else SLIDE_SCREENED
+                rank_squares = RANK_SQUARES[y]
+                for position in RANK_SLIDES[x][rank_occupancy[y]][hits]:
+                    to_sq = rank_squares[position]
+                    if (cells[to_sq] > 0) != red:
+                        captures.append((from_sq << 7) | to_sq)
+                file_squares = FILE_SQUARES[x]
+                for position in FILE_SLIDES[y][file_occupancy[x]][hits]:
+                    to_sq = file_squares[position]
+                    if (cells[to_sq] > 0) != red:
+                        captures.append((from_sq << 7) | to_sq)
+            else:
+                for to_sq, block_sq in LEAPER_MOVES[code + SOLDIER][from_sq]:
+                    target = cells[to_sq]
+                    if target and (target > 0) != red and not (block_sq >= 0 and cells[block_sq]):
+                        captures.append((from_sq << 7) | to_sq)
+        return captures
+
+    def in_check(self, color: Color) -> bool:
+        square = self.general_squares[0 if color == Color.RED else 1]
+        return square >= 0 and self.attacker_square(square, color != Color.RED) >= 0
+
+    def is_attacked(self, square: int, by_red: bool) -> bool:
+        """True when a piece of by_red's side attacks square, see attacker_square"""
+        return self.attacker_square(square, by_red) >= 0
+
+    def attacker_square(self, square: int, by_red: bool) -> int:
+        """
+        Square of a piece of by_red's side attacking square, -1 when there is none.
+        Looks outwards from square for an enemy chariot, cannon behind one screen,
+        horse with a free leg, soldier next to it, or a general facing it along the file.
+        Reads only cells and the occupancy masks, so it can be called on a half-made move.
+        """
+        cells = self.cells
+        sign = 1 if by_red else -1
+        chariot = CHARIOT * sign
+        cannon = CANNON * sign
+        x = SQUARE_X[square]
+        y = SQUARE_Y[square]
+        rank = RANK_SLIDES[x][self.rank_occupancy[y]]
+        file = FILE_SLIDES[y][self.file_occupancy[x]]
+        rank_squares = RANK_SQUARES[y]
+        file_squares = FILE_SQUARES[x]
+        for position in rank[SLIDE_BLOCKERS]:
+            if cells[rank_squares[position]] == chariot:
+                return rank_squares[position]
+        for position in file[SLIDE_BLOCKERS]:
+            target = cells[file_squares[position]]
+            if target == chariot or target == GENERAL * sign:
+                return file_squares[position]
+        for position in rank[SLIDE_SCREENED]:
+            if cells[rank_squares[position]] == cannon:
+                return rank_squares[position]
+        for position in file[SLIDE_SCREENED]:
+            if cells[file_squares[position]] == cannon:
+                return file_squares[position]
+        horse = HORSE * sign
+        for horse_sq, leg_sq in HORSE_CHECKS[square]:
+            if cells[horse_sq] == horse and not cells[leg_sq]:
+                return horse_sq
+        soldier = SOLDIER * sign
+        behind = y - 1 if by_red else y + 1
+        if 0 <= behind < BOARD_HEIGHT and cells[behind * BOARD_WIDTH + x] == soldier:
+            return behind * BOARD_WIDTH + x
+        # a soldier only moves sideways once it has crossed the river
+        if (y > 4) if by_red else (y < 5):
+            if x > 0 and cells[square - 1] == soldier:
+                return square - 1
+            if x < BOARD_WIDTH - 1 and cells[square + 1] == soldier:
+                return square + 1
+        return -1
+
+    def pinned_squares(self, general_sq: int) -> set:
+        """
+        Squares where a change of occupancy can expose the general on general_sq:
+        everything along its lines up to the second piece (chariot, cannon screen, facing general)
+        and its diagonal neighbours (legs of checking horses)
+        """
+        pinned = set(DIAGONAL_NEIGHBOURS[general_sq])
+        x = SQUARE_X[general_sq]
+        y = SQUARE_Y[general_sq]
+        for line, line_squares in ((RANK_SLIDES[x][self.rank_occupancy[y]], RANK_SQUARES[y]),
+                                   (FILE_SLIDES[y][self.file_occupancy[x]], FILE_SQUARES[x])):
+            for positions in line:
+                for position in positions:
+                    pinned.add(line_squares[position])
+        return pinned
+
+    def _exposes_general(self, from_sq: int, to_sq: int, general_sq: int, red: bool) -> bool:
+        """Plays the move on cells and occupancy masks only and tests the general's square"""
+        cells = self.cells
+        rank_occupancy = self.rank_occupancy
+        file_occupancy = self.file_occupancy
+        from_x = SQUARE_X[from_sq]
+        from_y = SQUARE_Y[from_sq]
+        to_x = SQUARE_X[to_sq]
+        to_y = SQUARE_Y[to_sq]
+        saved = (rank_occupancy[from_y], rank_occupancy[to_y], file_occupancy[from_x], file_occupancy[to_x])
+        moved = cells[from_sq]
+        captured = cells[to_sq]
+        cells[to_sq] = moved
+        cells[from_sq] = EMPTY
+        rank_occupancy[from_y] &= ~(1 << from_x)
+        file_occupancy[from_x] &= ~(1 << from_y)
+        rank_occupancy[to_y] |= 1 << to_x
+        file_occupancy[to_x] |= 1 << to_y
+        exposed = self.attacker_square(to_sq if from_sq == general_sq else general_sq, not red) >= 0
+        cells[from_sq] = moved
+        cells[to_sq] = captured
+        # restore in reverse order, from and to may share a rank or a file
+        file_occupancy[to_x] = saved[3]
+        file_occupancy[from_x] = saved[2]
+        rank_occupancy[to_y] = saved[1]
+        rank_occupancy[from_y] = saved[0]
+        return exposed
+
+    def generate_legal_moves(self, color: Color, piece: Optional[Piece] = None) -> List[int]:
+        """
+        Legal moves of color, packed. Checkers and pinned squares are found once from the general's square;
+        only general moves, moves touching a pinned square and evasions are tested, on cells alone.
+        """
+        moves = self.generate_moves(color, piece=piece)
+        red = color == Color.RED
+        general_sq = self.general_squares[0 if red else 1]
+        if general_sq >= 0:
+            in_check = self.attacker_square(general_sq, not red) >= 0
+            pinned = self.pinned_squares(general_sq)
+            legal = []
+            for move in moves:
+                from_sq = move >> 7
+                to_sq = move & 127
+                if (in_check or from_sq == general_sq or from_sq in pinned or to_sq in pinned) and \
+                        self._exposes_general(from_sq, to_sq, general_sq, red):
+                    continue
+                legal.append(move)
+            moves = legal
+        return moves
+
+    def get_piece_valid_moves(self, piece: Piece, check=True, for_eval=False) -> List[Vector]:
+        from_sq = piece.get_square()
+        if check and not for_eval:
+            return [SQUARE_VECTORS[move & 127] for move in self.generate_legal_moves(piece.get_color(), piece)]
+        return [SQUARE_VECTORS[to_sq] for to_sq in self.piece_targets(from_sq, for_eval=for_eval)
+                if (not check) or self.is_legal(from_sq, to_sq, piece.get_color())]
 
     def has_piece(self, position: Vector) -> bool:
-        sq = self.get_square(position, area=FULLBOARD_AREA)
-        return bool(sq) and bool(sq.get_piece())
+        return self.get_piece(position) is not None
 
     def is_mate(self):
-        mate = 3
-        for i,team in enumerate((self.reds, self.blacks)):
-            for piece in team:
-                if isinstance(piece, General):
-                    mate -= i+1
-                    break
-        if mate == 0:
+        red_general = self.counts[SOLDIER + GENERAL]
+        black_general = self.counts[SOLDIER - GENERAL]
+        if red_general and black_general:
             return 0
-        elif mate == 1:
+        elif black_general:
             return -inf
         else:
             return inf
 
-
     def evaluate(self, eval_set: EvaluateSet, describe=False):
+        """
+        Combines the incrementally maintained terms, no board scan.
+        Mobility and control count pseudo-legal controlled squares.
+        """
         if self.uncapturing_moves_count > 49:
             return 0
         res = self.is_mate()
         if res:
             return res 
-        total_value = 0
-        self.reset_control_state()
-        value_multiplier, attack_bonus, mobility_multiplier, control_multiplier = eval_set.get()
-        for i,team in enumerate((self.reds, self.blacks)):
-            team_values = team_attack_bonus = team_mobility = 0
-            for piece in team:
-                team_values += piece.get_value() * value_multiplier
-                if attack_bonus:
-                    team_attack_bonus += attack_bonus if piece.is_attacker() else 0
-                if mobility_multiplier:
-                    vds = self.get_piece_valid_moves(piece, check=True, for_eval=True)
-                    team_mobility += len(vds)* mobility_multiplier
-                if control_multiplier:
-                    self.update_control_state(piece.get_color(), vds)
-                if describe:
-                    #print(f"BOARD Evaluating: for {piece} valid moves {vds}")
-                    print(f"BOARD: {piece.get_color().name} values = {team_values}")
-                    print(f"BOARD: {piece.get_color().name} attack bonus = {team_attack_bonus}")
-                    print(f"BOARD: {piece.get_color().name} mobility = {team_mobility}")
-            total_value += (team_values + team_attack_bonus + team_mobility) * ((-1) if i else 1)
-        if control_multiplier:
-            for rows in self.squares:
-                for square in rows:
-                    total_value += square.get_state().value * (control_multiplier if square.get_piece() is None else (control_multiplier+attack_bonus))
-        
+        value_multiplier, attack_bonus, mobility_multiplier, control_multiplier, position_multiplier = eval_set.get()
+        material = self.material
+        if eval_set.piece_values is not None:
+            counts = self.counts
+            material = [sum(counts[SOLDIER + code] * value for code, value in eval_set.piece_values.items()),
+                        sum(counts[SOLDIER - code] * value for code, value in eval_set.piece_values.items())]
+        attackers = self.attacker_count
+        mobility = self.mobility
+        position = self.position_score
+        control = (self.control_balance * control_multiplier + self.control_occupied * attack_bonus) if control_multiplier else 0
+        total_value = ((material[0] - material[1]) * value_multiplier
+                       + (attackers[0] - attackers[1]) * attack_bonus
+                       + (mobility[0] - mobility[1]) * mobility_multiplier
+                       + (position[0] - position[1]) * position_multiplier
+                       + control)
+        if describe:
+            for i, color in enumerate(Color):
+                print(f"BOARD: {color.name} values = {material[i] * value_multiplier}")
+                print(f"BOARD: {color.name} attack bonus = {attackers[i] * attack_bonus}")
+                print(f"BOARD: {color.name} mobility = {mobility[i] * mobility_multiplier}")
+                print(f"BOARD: {color.name} position = {position[i] * position_multiplier}")
+            print(f"BOARD: control = {control}")
         return total_value
 
     def update_evaluation(self, eval_set: EvaluateSet, describe=False):
         self.evaluation = self.evaluate(eval_set, describe=describe)
         return self.evaluation
 
-    def update_control_state(self, color:Color, attacks: List[Vector]):
-        for attack in attacks:
-            square = self.get_square(attack)
-            square.add_attack(color)
+    def _control_sign(self, square: int) -> int:
+        diff = self.red_control[square] - self.black_control[square]
+        return (diff > 0) - (diff < 0)
 
-    def reset_control_state(self):
-        for row in self.squares:
-            for square in row:
-                square.reset_attacks()
+    def get_control_state(self, square: int) -> Square_status:
+        red_attacks = self.red_control[square]
+        black_attacks = self.black_control[square]
+        if red_attacks > black_attacks:
+            return Square_status.red
+        elif black_attacks > red_attacks:
+            return Square_status.black
+        return Square_status.neutral
 
     def get_reds(self):
         return self.reds
@@ -328,7 +802,7 @@ class Board:
             line = str(vert)
             line += "║"
             for j in range(9):
-                print_piece = self.squares[j][vert].get_piece()
+                print_piece = self.pieces[vert * BOARD_WIDTH + j]
                 if i in (4,9):
                     between = "┴"
                 elif i in (5, 0):
@@ -365,7 +839,7 @@ class Board:
             line = ""
             for j in range(9):
                 vert = i if prespective==Color.BLACK else (9-i)
-                state = self.squares[j][vert].get_state()
+                state = self.get_control_state(vert * BOARD_WIDTH + j)
                 color = textcolors.lightgrey
                 if state==Square_status.red:
                     color = textcolors.red
@@ -0,0 +1,202 @@
+"""
+Opening book: a sorted binary file of (position key, move, weight) entries read through mmap,
+so every process using the same book shares one copy of it in the page cache.
+
+File: 16 byte header (MAGIC, entry count, 0) then ENTRY records sorted by key, for a key
+by falling weight. key = zobrist.side_key of the position, move is packed (see supports).
+
+    python book.py build book.bin --games games.txt --max-ply 20
+    python book.py selfplay book.bin --games 40 --depth 3 --plies 16
+    python book.py show book.bin ["FEN"]
+
+games.txt has one game per line: an optional "FEN |" and the moves "x,y to x,y" separated by ';'.
+"""
+import argparse
+import mmap
+import random
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+from board import Board
+from supports import Color, EvaluateSet, Vector, SQUARE_VECTORS, square_of
+from zobrist import side_key
+from fen import parse_fen, START_FEN
+
+MAGIC = b"XQBOOK01"
+HEADER = struct.Struct("<8sII")
+ENTRY = struct.Struct("<QHH")
+MAX_WEIGHT = 0xFFFF
+
+# a game record: (start FEN, packed moves)
+GameRecord = Tuple[str, List[int]]
+
+class OpeningBook:
+    """Read-only view of a book file"""
+    def __init__(self, path: str, seed: Optional[int] = None):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size, _ = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or HEADER.size + self.size * ENTRY.size > len(self.data):
+            self.close()
+            raise ValueError(f"{path} is not an opening book")
+        self.random = random.Random(seed)
+        self.hits = 0
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.file.close()
+
+    def _key_at(self, index: int) -> int:
+        return ENTRY.unpack_from(self.data, HEADER.size + index * ENTRY.size)[0]
+
+    def moves(self, key: int) -> List[Tuple[int, int]]:
+        """(move, weight) stored for the position key, heaviest first"""
+        low = 0
+        high = self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        result = []
+        offset = HEADER.size + low * ENTRY.size
+        for _ in range(low, self.size):
+            entry_key, move, weight = ENTRY.unpack_from(self.data, offset)
+            if entry_key != key:
+                break
+            result.append((move, weight))
+            offset += ENTRY.size
+        return result
+
+    def probe(self, board: Board, color: Color) -> Optional[int]:
+        """A legal book move for color picked at random by weight, None when the position is not in the book"""
+        entries = self.moves(side_key(board.hash, color == Color.RED))
+        if not entries:
+            return None
+        legal = set(board.generate_legal_moves(color))
+        # a key collision or a stale book must never produce an illegal move
+        entries = [(move, weight) for move, weight in entries if move in legal and weight]
+        if not entries:
+            return None
+        self.hits += 1
+        return self.random.choices([move for move, _ in entries], [weight for _, weight in entries])[0]
+
+def write_book(path: str, positions: Dict[int, Dict[int, int]], min_count: int = 1) -> int:
+    """Writes {key: {move: count}} as a book, moves seen fewer than min_count times are left out. Returns entries"""
+    entries = []
+    for key, moves in positions.items():
+        for move, count in moves.items():
+            if count >= min_count:
+                entries.append((key, -count, move))
+    entries.sort()
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries), 0))
+        for key, count, move in entries:
+            f.write(ENTRY.pack(key, move, min(-count, MAX_WEIGHT)))
+    return len(entries)
+
+def add_game(positions: Dict[int, Dict[int, int]], record: GameRecord, max_ply: int):
+    """Counts the moves of the first max_ply plies of a game"""
+    fen, moves = record
+    board, color = parse_fen(fen)
+    for move in moves[:max_ply]:
+        if move not in board.generate_legal_moves(color):
+            raise ValueError(f"Illegal move {SQUARE_VECTORS[move >> 7]}->{SQUARE_VECTORS[move & 127]} in game from {fen}")
+        counts = positions.setdefault(side_key(board.hash, color == Color.RED), {})
+        counts[move] = counts.get(move, 0) + 1
+        board.make_move(move >> 7, move & 127)
+        color = color.opposite()
+
+def build_book(path: str, records: Iterable[GameRecord], max_ply: int = 20, min_count: int = 1) -> int:
+    positions: Dict[int, Dict[int, int]] = {}
+    for record in records:
+        add_game(positions, record, max_ply)
+    return write_book(path, positions, min_count)
+
+def parse_game(line: str) -> GameRecord:
+    """'[FEN |] x,y to x,y; x,y to x,y; ...' -> (FEN, packed moves)"""
+    fen = START_FEN
+    if "|" in line:
+        fen, line = line.split("|", 1)
+        fen = fen.strip()
+    moves = []
+    for text in line.split(";"):
+        text = text.strip()
+        if not text:
+            continue
+        from_text, to_text = text.split(" to ")
+        from_sq = square_of(Vector(*map(int, from_text.split(","))))
+        to_sq = square_of(Vector(*map(int, to_text.split(","))))
+        moves.append((from_sq << 7) | to_sq)
+    return fen, moves
+
+def read_games(path: str) -> List[GameRecord]:
+    with open(path) as f:
+        return [parse_game(line) for line in f if line.strip()]
+
+def self_play(games: int, depth: int, plies: int, explore: float = 0.25, seed: int = 0,
+              eval_set: Optional[EvaluateSet] = None) -> Dict[int, Dict[int, int]]:
+    """
+    Engine games from the start position, returns {key: {move: count}} of the engine's moves.
+    With probability explore a random legal move is played instead to vary the lines, it is not counted.
+    """
+    from engine import Engine   # engine imports this module
+    rng = random.Random(seed)
+    engine = Engine(eval_set or EvaluateSet(), depth=depth)
+    positions: Dict[int, Dict[int, int]] = {}
+    for _ in range(games):
+        board, color = parse_fen(START_FEN)
+        for _ in range(plies):
+            legal = board.generate_legal_moves(color)
+            if not legal:
+                break
+            if rng.random() < explore:
+                move = rng.choice(legal)
+            else:
+                _, best = engine.get_best_move(board, color)
+                move = (square_of(best[0]) << 7) | square_of(best[1])
+                counts = positions.setdefault(side_key(board.hash, color == Color.RED), {})
+                counts[move] = counts.get(move, 0) + 1
+            board.make_move(move >> 7, move & 127)
+            color = color.opposite()
+    return positions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Opening book builder")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="book from game records")
+    build.add_argument("book")
+    build.add_argument("--games", required=True, help="text file, one game per line")
+    build.add_argument("--max-ply", type=int, default=20)
+    build.add_argument("--min-count", type=int, default=1)
+    play = commands.add_parser("selfplay", help="book from engine games")
+    play.add_argument("book")
+    play.add_argument("--games", type=int, default=40)
+    play.add_argument("--depth", type=int, default=3)
+    play.add_argument("--plies", type=int, default=16)
+    play.add_argument("--explore", type=float, default=0.25)
+    play.add_argument("--seed", type=int, default=0)
+    show = commands.add_parser("show", help="book moves of a position")
+    show.add_argument("book")
+    show.add_argument("fen", nargs="?", default=START_FEN)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build_book(args.book, read_games(args.games), args.max_ply, args.min_count)
+        print(f"{args.book}: {count} entries")
+    elif args.command == "selfplay":
+        count = write_book(args.book, self_play(args.games, args.depth, args.plies, args.explore, args.seed))
+        print(f"{args.book}: {count} entries from {args.games} games")
+    else:
+        book = OpeningBook(args.book)
+        board, color = parse_fen(args.fen)
+        for move, weight in book.moves(side_key(board.hash, color == Color.RED)):
+            print(f"{SQUARE_VECTORS[move >> 7].x},{SQUARE_VECTORS[move >> 7].y} to "
+                  f"{SQUARE_VECTORS[move & 127].x},{SQUARE_VECTORS[move & 127].y}: {weight}")
+        book.close()
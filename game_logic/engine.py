@@ -1,95 +1,539 @@
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Dict
 import math
 from board import Board
-from pieces import Piece, General
-from supports import EvaluateSet, Vector, Color
+from supports import EvaluateSet, Vector, Color, SQUARE_VECTORS, EMPTY, HORSE, CHARIOT, CANNON, SOLDIER
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+from zobrist import side_key
+from move_ordering import MoveOrderer, PIECE_VALUES
+from book import OpeningBook
+from tablebase import Tablebases, result_of
+from search_stats import SearchStats, MOVEGEN, ORDERING, EVALUATION, QUIESCENCE, PHASES
 import random
+import time
+import pickle
+import multiprocessing
+import os
+
+class SearchAborted(Exception):
+    """Raised inside the search once the time or node budget of get_best_move is spent"""
+
+# time is read from the clock once per this many nodes
+TIME_CHECK_INTERVAL = 1024
+# quiescence plies in which check evasions are searched, deeper only captures (stops perpetual checks)
+QUIESCENCE_CHECK_PLIES = 4
+# width of the scout window of principal variation search, scores are whole numbers with integer weights
+NULL_WINDOW = 1
+# null move pruning: shallowest node it is tried at, and the side to move needs this many
+# chariots, horses and cannons, with less zugzwang is likely and passing is not a safe guess
+NULL_MOVE_MIN_DEPTH = 3
+NULL_MOVE_MIN_PIECES = 2
+# late move reductions: shallowest node and number of moves searched at full depth first
+LMR_MIN_DEPTH = 3
+LMR_FULL_MOVES = 3
+# score of a tablebase win, less the plies to the mate so that faster mates score higher
+TABLEBASE_WIN = 1_000_000
+# scores beyond this are tablebase wins and losses, counted from the root of the search
+TABLEBASE_SCORES = TABLEBASE_WIN - 10_000
+
+# state of a worker process of the root splitting search, see Engine.parallel_search_root
+_worker_engine = None
+_worker_bounds = None
+_worker_root = None     # (search id, root board) of the search the worker takes part in
+
+def _tt_score(score: float, ply: int) -> float:
+    """Tablebase scores from the root of the search to scores from the node ply plies below it"""
+    if score >= TABLEBASE_SCORES:
+        return score + ply
+    if score <= -TABLEBASE_SCORES:
+        return score - ply
+    return score
+
+def _search_score(score: float, ply: int) -> float:
+    """The inverse of _tt_score, for a score read from the transposition table at ply"""
+    if score >= TABLEBASE_SCORES:
+        return score - ply
+    if score <= -TABLEBASE_SCORES:
+        return score + ply
+    return score
+
+def _init_worker(config: dict, bounds):
+    global _worker_engine, _worker_bounds
+    _worker_engine = Engine(**config)
+    _worker_bounds = bounds
+
+def _search_root_move(task) -> Tuple[int, Optional[float], bool, int, int, int, SearchStats]:
+    """
+    Searches one root move in a worker.
+    Returns (move, value or None when out of budget, whether the value is exact rather than the bound
+    of a failed scout, nodes, qnodes, worker pid, worker counters of the search)
+    """
+    global _worker_root
+    search_id, board_state, red, move, depth, deadline, node_limit, check_budget = task
+    engine = _worker_engine
+    if _worker_root is None or _worker_root[0] != search_id:
+        _worker_root = (search_id, pickle.loads(board_state))
+        engine.start_search(_worker_root[1], deadline - time.time() if deadline is not None else None, node_limit)
+    board = _worker_root[1]
+    engine.check_budget = check_budget
+    nodes = engine.nodes
+    qnodes = engine.qnodes
+
+    bounds = _worker_bounds
+    with bounds.get_lock():
+        alpha = bounds[0]
+        beta = bounds[1]
+    try:
+        value = engine.search_move(board, move, depth, alpha, beta, red,
+                                   alpha > -math.inf if red else beta < math.inf)
+    except SearchAborted:
+        while board.ply > engine.root_ply:
+            board.unmake_move()
+        value = None
+    # the window is (alpha, inf) for RED and (-inf, beta) for BLACK, only the bound from the best so far can fail
+    exact = value is not None and not (value <= alpha if red else value >= beta)
+    if value is not None:
+        with bounds.get_lock():
+            if red and value > bounds[0]:
+                bounds[0] = value
+            elif not red and value < bounds[1]:
+                bounds[1] = value
+    stats = engine.collect_stats(0.0)
+    stats.nodes = stats.qnodes = 0
+    return move, value, exact, engine.nodes - nodes, engine.qnodes - qnodes, os.getpid(), stats
 
 class Engine:
-    def __init__(self, eval_set:EvaluateSet, depth: int = 3, debug: bool = False):
+    def __init__(self, eval_set:EvaluateSet, depth: int = 3, debug: bool = False, hash_mb: float = 16,
+                 time_limit: Optional[float] = None, node_limit: Optional[int] = None,
+                 orderer: Optional[MoveOrderer] = None, quiescence: bool = True, delta_margin: float = 2,
+                 pvs: bool = True, aspiration_window: Optional[float] = 1,
+                 null_move: bool = True, null_reduction: int = 2, lmr: bool = True, lmr_reduction: int = 1,
+                 workers: int = 1, profile: bool = False, book: Optional[OpeningBook] = None,
+                 tablebases: Optional[Tablebases] = None):
+        """
+        params: depth: deepest iteration of get_best_move
+                hash_mb: memory budget of the transposition table, kept between get_best_move calls
+                time_limit: default seconds per get_best_move, None = no limit
+                node_limit: default nodes per get_best_move, None = no limit
+                orderer: move ordering used at every node, MoveOrderer() by default
+                quiescence: resolve captures and checks at the horizon instead of evaluating there
+                delta_margin: in piece value units, captures that cannot lift the score above
+                              alpha even with this margin are skipped in quiescence
+                pvs: search all but the first move of a node with a null window first
+                aspiration_window: in piece value units, iterations after the first search the root
+                                   in this window around the previous score, None = full window
+                null_move: let the side to move pass, a pass that still fails high prunes the node
+                null_reduction: the pass is searched this many plies shallower than the node
+                lmr: search quiet moves ordered after the first LMR_FULL_MOVES with lmr_reduction
+                     plies less, again at full depth only when they beat the best move
+                workers: processes splitting the root moves, 1 = search in this process.
+                         The pool is started on the first search, close() stops it.
+                profile: time the search phases (see search_stats) into the stats of each search
+                book: opening book, a book move is played without searching while the game is in it
+                tablebases: endgame tables, positions they cover are scored by distance to mate
+                            instead of searched, at the root the move is picked from them
+        """
         self.debug = debug
         self.depth = depth
         self.eval_set = eval_set
+        self.hash_mb = hash_mb
+        self.tt = TranspositionTable(hash_mb)
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.orderer = orderer if orderer is not None else MoveOrderer()
+        self.quiescence = quiescence
+        self.delta_margin = delta_margin
+        self.pvs = pvs
+        self.aspiration_window = aspiration_window
+        self.null_move = null_move
+        self.null_reduction = null_reduction
+        self.lmr = lmr
+        self.lmr_reduction = lmr_reduction
+        self.workers = workers
+        self.profile = profile
+        self.book = book
+        self.tablebases = tablebases
+        self.stats = SearchStats()
+        self.worker_stats: Dict[int, SearchStats] = {}
+        self.evaluations = 0
+        self.movegen_calls = 0
+        self.phase_times: Dict[str, float] = {}
+        self.pool = None
+        self.bounds = None
+        self.search_id = 0
+        self.root_ply = 0
+        self.nodes = 0
+        self.qnodes = 0
+        self.completed_depth = 0
+        # (depth, seconds since the search started, nodes + qnodes, value, packed best move) per iteration
+        self.iterations: List[Tuple[int, float, int, float, int]] = []
+        self.scouts = 0
+        self.pvs_researches = 0
+        self.aspiration_searches = 0
+        self.aspiration_researches = 0
+        self.null_tries = 0
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.lmr_researches = 0
+        self.tablebase_hits = 0
+        # most a capture can gain in quiescence per unsigned piece code, again at every search start
+        self.capture_gains = self.delta_gains()
+        self.deadline: Optional[float] = None
+        self.max_nodes: Optional[int] = None
+        self.check_budget = False
 
-    def get_best_move(self, board: Board, current_player: Color, is_random:bool = False) -> Optional[Tuple[Vector, Vector]]:
-        alpha = -math.inf
-        beta = math.inf
-        if is_random:
-            best_moves = []
-        pieces = board.get_reds() if current_player == Color.RED else board.get_blacks()
-        moves = []
-        for piece in pieces:
-            from_pos = piece.get_position()
-            valid_moves = board.get_piece_valid_moves(piece, check=True)
-            
-            for to_pos in valid_moves:
-                target_square = board.get_square(to_pos)
-                eval_bonus = 0
-                captured_piece = target_square.get_piece()
-
-                if captured_piece is not None:
-                    eval_bonus += captured_piece.get_value() * 0.5
-
-                if piece.is_attacker():
-                    eval_bonus += 0.3
-                
-                moves.append((eval_bonus, from_pos, to_pos))
-        moves.sort(reverse=(current_player == Color.RED), key=lambda x: x[0])
-
-        if len(moves):
-            best_move = (moves[0][1], moves[0][2])
+    def get_best_move(self, board: Board, current_player: Color, is_random:bool = False,
+                      time_limit: Optional[float] = None, node_limit: Optional[int] = None,
+                      return_stats: bool = False) -> tuple:
+        """
+        Returns (value, (from, to)) of search, or (value, (from, to), SearchStats) with return_stats.
+        The counters of the last search are also kept in self.stats.
+        """
+        start = time.perf_counter()
+        book_move = self.book.probe(board, current_player) if self.book is not None else None
+        tablebase = self.tablebase_move(board, current_player) if book_move is None else None
+        if book_move is not None:
+            move_value = board.evaluate(self.eval_set)
+            best_move = (SQUARE_VECTORS[book_move >> 7], SQUARE_VECTORS[book_move & 127])
+            self.stats = SearchStats()
+            self.stats.searches = 1
+            self.stats.book_hits = 1
+            self.stats.seconds = time.perf_counter() - start
+        elif tablebase is not None:
+            move_value, tablebase_move = tablebase
+            best_move = (SQUARE_VECTORS[tablebase_move >> 7], SQUARE_VECTORS[tablebase_move & 127])
+            self.stats = SearchStats()
+            self.stats.searches = 1
+            self.stats.tablebase_hits = 1
+            self.stats.seconds = time.perf_counter() - start
         else:
+            move_value, best_move = self.search(board, current_player, is_random, time_limit, node_limit)
+            self.stats = self.collect_stats(time.perf_counter() - start)
+        if return_stats:
+            return move_value, best_move, self.stats
+        return move_value, best_move
+
+    def search(self, board: Board, current_player: Color, is_random: bool = False,
+               time_limit: Optional[float] = None, node_limit: Optional[int] = None) -> Tuple[float, Optional[Tuple[Vector, Vector]]]:
+        """
+        Iterative deepening up to self.depth. When the time (seconds) or node budget runs out
+        the unfinished iteration is dropped and the last completed one is returned.
+        The first iteration always completes, so a legal move is always found.
+        With workers > 1 the root moves are split over processes, is_random searches here.
+        Returns (value, (from, to)), the move is None when there is no legal move.
+        """
+        time_limit = self.time_limit if time_limit is None else time_limit
+        node_limit = self.node_limit if node_limit is None else node_limit
+        start = time.perf_counter()
+        self.start_search(board, time_limit, node_limit)
+        root_ply = board.ply
+        parallel = self.workers > 1 and not is_random
+        if parallel:
+            self.search_id += 1
+            board_state = pickle.dumps(board, pickle.HIGHEST_PROTOCOL)
+            # wall clock, the workers read their own clocks
+            deadline = time.time() + time_limit if time_limit is not None else None
+
+        moves = self.order_root_moves(board, current_player)
+        if not moves:
+            return (-math.inf if current_player == Color.RED else math.inf, self.handle_gameover(board, current_player))
+
+        result = None
+        for depth in range(min(2, self.depth), self.depth + 1):
+            try:
+                if parallel:
+                    result = self.parallel_search_root(board, board_state, current_player, moves, depth,
+                                                       deadline, node_limit)
+                else:
+                    result = self.aspiration_search(board, current_player, moves, depth, is_random,
+                                                    result[0] if result is not None else None)
+            except SearchAborted:
+                while board.ply > root_ply:
+                    board.unmake_move()
+                break
+            self.completed_depth = depth
+            self.iterations.append((depth, time.perf_counter() - start, self.nodes + self.qnodes, result[0], result[1]))
+            # the next iteration starts from this one's best move, the TT holds the rest of the line
+            moves.remove(result[1])
+            moves.insert(0, result[1])
+            self.check_budget = time_limit is not None or node_limit is not None
+            # a mate for the side to move cannot be improved on by searching deeper
+            if result[0] == (math.inf if current_player == Color.RED else -math.inf):
+                break
+            # an iteration costs several times the previous one, do not start what cannot finish
+            if self.deadline is not None and time.perf_counter() - start > time_limit / 2:
+                break
+
+        move_value, best_move, best_moves = result
+        if is_random and best_moves:
+            best_move = random.choice(best_moves)
+        elif is_random:
             best_move = None
+        if best_move is None:
+            return (move_value, self.handle_gameover(board, current_player))
+        return (move_value, (SQUARE_VECTORS[best_move >> 7], SQUARE_VECTORS[best_move & 127]))
+
+    def start_search(self, board: Board, time_limit: Optional[float], node_limit: Optional[int]):
+        """Resets the budget, the counters and the search generation, the board position is the root"""
+        self.deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        self.max_nodes = node_limit
+        self.check_budget = False
+        self.nodes = 0
+        self.qnodes = 0
+        self.completed_depth = 0
+        self.iterations = []
+        self.scouts = 0
+        self.pvs_researches = 0
+        self.aspiration_searches = 0
+        self.aspiration_researches = 0
+        self.null_tries = 0
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.lmr_researches = 0
+        self.tablebase_hits = 0
+        self.evaluations = 0
+        self.movegen_calls = 0
+        self.phase_times = {phase: 0.0 for phase in PHASES} if self.profile else {}
+        self.worker_stats = {}
+        self.tt.new_search()
+        self.orderer.new_search()
+        self.root_ply = board.ply
+        self.capture_gains = self.delta_gains()
+
+    def delta_gains(self) -> List[float]:
+        """
+        Value of capturing each unsigned piece code plus delta_margin, scaled as the evaluation
+        scores it: the eval set's own piece values, the piece classes' when it has none
+        """
+        values = self.eval_set.piece_values
+        return [((values.get(code, 0) if values is not None else PIECE_VALUES[code]) + self.delta_margin)
+                * self.eval_set.value_multiplier for code in range(len(PIECE_VALUES))]
+
+    def collect_stats(self, seconds: float) -> SearchStats:
+        """Counters of the search so far, with those of the worker processes"""
+        stats = SearchStats()
+        stats.searches = 1
+        stats.depth = self.completed_depth
+        stats.seconds = seconds
+        stats.nodes = self.nodes
+        stats.qnodes = self.qnodes
+        stats.cutoffs = self.orderer.cutoffs
+        stats.first_move_cutoffs = self.orderer.first_move_cutoffs
+        stats.evaluations = self.evaluations
+        stats.tt_probes = self.tt.probes
+        stats.tt_hits = self.tt.hits
+        stats.movegen_calls = self.movegen_calls
+        stats.scouts = self.scouts
+        stats.pvs_researches = self.pvs_researches
+        stats.aspiration_researches = self.aspiration_researches
+        stats.null_tries = self.null_tries
+        stats.null_cutoffs = self.null_cutoffs
+        stats.reductions = self.reductions
+        stats.lmr_researches = self.lmr_researches
+        stats.tablebase_hits = self.tablebase_hits
+        stats.phase_times = dict(self.phase_times)
+        for worker in self.worker_stats.values():
+            stats.add(worker)
+        stats.searches = 1
+        stats.seconds = seconds
+        return stats
+
+    def timed(self, phase: str, func, *args):
+        """func(*args), its run time added to phase"""
+        start = time.perf_counter()
+        result = func(*args)
+        self.phase_times[phase] += time.perf_counter() - start
+        return result
 
+    def worker_config(self) -> dict:
+        """Constructor arguments of the engines in the worker processes"""
+        return dict(eval_set=self.eval_set, depth=self.depth, hash_mb=self.hash_mb, orderer=self.orderer,
+                    quiescence=self.quiescence, delta_margin=self.delta_margin, pvs=self.pvs,
+                    aspiration_window=self.aspiration_window, null_move=self.null_move,
+                    null_reduction=self.null_reduction, lmr=self.lmr, lmr_reduction=self.lmr_reduction,
+                    profile=self.profile, tablebases=self.tablebases)
+
+    def get_pool(self):
+        if self.pool is None:
+            # best scores found so far at the root: [alpha, beta]
+            self.bounds = multiprocessing.Array('d', 2)
+            self.pool = multiprocessing.Pool(self.workers, _init_worker, (self.worker_config(), self.bounds))
+        return self.pool
+
+    def close(self):
+        """Stops the worker processes"""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def parallel_search_root(self, board: Board, board_state: bytes, current_player: Color, moves: List[int],
+                             depth: int, deadline: Optional[float], node_limit: Optional[int]) -> Tuple[float, int, List[int]]:
+        """
+        Root splitting: the first move is searched alone with the full window, the rest are shared
+        out to the workers one by one. A worker starts each move from the best score any worker has
+        reported so far and scouts it with a null window. Each worker keeps its own transposition
+        table and gets node_limit / workers nodes.
+        Returns (value, best move, []) like search_root.
+        """
+        pool = self.get_pool()
+        red = current_player == Color.RED
+        bounds = self.bounds
+        with bounds.get_lock():
+            bounds[0] = -math.inf
+            bounds[1] = math.inf
+        worker_nodes = node_limit // self.workers if node_limit is not None else None
+        check_budget = self.check_budget
+        tasks = [(self.search_id, board_state, red, move, depth, deadline, worker_nodes, check_budget)
+                 for move in moves]
+
+        results = [pool.apply(_search_root_move, (tasks[0],))]
+        if results[0][1] is not None:
+            results.extend(pool.imap_unordered(_search_root_move, tasks[1:]))
+
+        values = {}
+        exact = {}
+        aborted = False
+        for move, value, is_exact, nodes, qnodes, pid, stats in results:
+            self.nodes += nodes
+            self.qnodes += qnodes
+            self.worker_stats[pid] = stats
+            if value is None:
+                aborted = True
+            values[move] = value
+            exact[move] = is_exact
+        if aborted:
+            raise SearchAborted()
+
+        # a failed scout is only a bound at or below the exact score that set its window, so the best
+        # move is the best exact one; the first move was searched with the full window and is exact
+        best_move = moves[0]
         for move in moves:
-            bonus, from_pos, to_pos = move
+            if exact[move] and (values[move] > values[best_move] if red else values[move] < values[best_move]):
+                best_move = move
+        move_value = values[best_move]
+        bound = EXACT if exact[best_move] else (UPPER if red else LOWER)
+        self.tt.store(side_key(board.hash, red), depth, bound, move_value, best_move)
+        return move_value, best_move, []
+
+    def aspiration_search(self, board: Board, current_player: Color, moves: List[int], depth: int,
+                          is_random: bool, previous: Optional[float]) -> Tuple[float, int, List[int]]:
+        """
+        Searches the root in a window around the previous iteration's score, a side that fails
+        is opened to infinity and the root is searched again.
+        """
+        if previous is None or self.aspiration_window is None or math.isinf(previous):
+            return self.search_root(board, current_player, moves, depth, is_random)
+
+        window = self.aspiration_window * self.eval_set.value_multiplier
+        alpha = previous - window
+        beta = previous + window
+        self.aspiration_searches += 1
+        while True:
+            result = self.search_root(board, current_player, moves, depth, is_random, alpha, beta)
+            if result[0] <= alpha and alpha > -math.inf:
+                alpha = -math.inf
+            elif result[0] >= beta and beta < math.inf:
+                beta = math.inf
+            else:
+                return result
+            self.aspiration_researches += 1
+            if self.debug:
+                print(f"ENGINE ASPIRATION: depth {depth} score {result[0]} outside the window, window ({alpha}, {beta})")
+
+    def research_rates(self) -> Tuple[float, float]:
+        """Share of scouts searched again and share of aspiration windows that failed in the last search"""
+        return (self.pvs_researches / self.scouts if self.scouts else 0.0,
+                self.aspiration_researches / self.aspiration_searches if self.aspiration_searches else 0.0)
+
+    def order_root_moves(self, board: Board, current_player: Color) -> List[int]:
+        tt_move = self.tt.get_move(side_key(board.hash, current_player == Color.RED))
+        self.movegen_calls += 1
+        return self.orderer.order(board, board.generate_moves(current_player, check=True), 0, tt_move)
+
+    def search_root(self, board: Board, current_player: Color, moves: List[int], depth: int,
+                    is_random: bool, alpha: float = -math.inf, beta: float = math.inf) -> Tuple[float, int, List[int]]:
+        """
+        Returns (value, best move, moves within 5% of the best when is_random).
+        A value outside (alpha, beta) is only a bound, see aspiration_search.
+        """
+        alpha_orig = alpha
+        beta_orig = beta
+        best_moves = []
+        best_move = moves[0]
+
+        for index, move in enumerate(moves):
+            from_sq = move >> 7
+            to_sq = move & 127
 
             if self.debug:
                 print()
                 print("=============================================================================================================================")
-                print(f"ENGINE for {current_player.name} with {from_pos}->{to_pos}:")
+                print(f"ENGINE for {current_player.name} with {SQUARE_VECTORS[from_sq]}->{SQUARE_VECTORS[to_sq]}:")
 
-            move_value = self.minimax(
-                    board=board,
-                    from_pos=from_pos,
-                    to_pos=to_pos,
-                    depth=self.depth,
-                    alpha=alpha,
-                    beta=beta,
-                    maximizing_player=(current_player == Color.RED))
+            move_value = self.search_move(board, move, depth, alpha, beta, current_player == Color.RED, index > 0)
 
             if self.debug:
-                print(f"ENGINE EVALUATION for {current_player.name} after {from_pos}->{to_pos}: {current_player.opposite().name} can get {move_value}")
+                print(f"ENGINE EVALUATION for {current_player.name} after {SQUARE_VECTORS[from_sq]}->{SQUARE_VECTORS[to_sq]}: {current_player.opposite().name} can get {move_value}")
                 print("=============================================================================================================================")
                 print()
 
             if current_player == Color.RED and move_value > alpha:
                 if is_random and ((move_value / alpha) if alpha else 2) < 1.05:
-                    best_moves.append((from_pos, to_pos))
+                    best_moves.append(move)
                 else:
-                    best_move = (from_pos, to_pos)
+                    best_move = move
+                alpha = move_value
                 if move_value == math.inf:
                     break
-                alpha = move_value
-                
+
             elif current_player == Color.BLACK and beta > move_value:
                 if is_random and ((beta / move_value) if move_value else 2) < 1.05:
-                    best_moves.append((from_pos, to_pos))
+                    best_moves.append(move)
                 else:
-                    best_move = (from_pos, to_pos)
-                if move_value == math.inf:
-                    break
+                    best_move = move
                 beta = move_value
+                if move_value == -math.inf:
+                    break
+
+            if beta <= alpha:
+                break
     
         move_value = alpha if current_player==Color.RED else beta
-        if is_random:
-            result = (move_value,
-                    self.handle_gameover(board, current_player) if best_moves==[] else random.choice(best_moves))
-        else:
-            result = (move_value,
-                    best_move if best_move else self.handle_gameover(board, current_player))
+        bound = UPPER if move_value <= alpha_orig else LOWER if move_value >= beta_orig else EXACT
+        self.tt.store(side_key(board.hash, current_player == Color.RED), depth, bound, move_value, best_move)
+        return move_value, best_move, best_moves
 
-        return result
+    def tablebase_score(self, board: Board, red_to_move: bool) -> Optional[float]:
+        """Score of the position by the tablebases, None when they do not cover it"""
+        value = self.tablebases.probe(board, red_to_move)
+        if value is None:
+            return None
+        self.tablebase_hits += 1
+        result, plies = result_of(value)
+        if result == 0:
+            return 0
+        score = TABLEBASE_WIN - (board.ply - self.root_ply) - plies
+        return score if (result > 0) == red_to_move else -score
+
+    def tablebase_move(self, board: Board, color: Color) -> Optional[Tuple[float, int]]:
+        """
+        (score, packed move) of the fastest win, else a draw, else the slowest loss by the tablebases.
+        None when they do not cover the position or every move out of it
+        """
+        if self.tablebases is None or self.tablebases.probe(board, color == Color.RED) is None:
+            return None
+        self.root_ply = board.ply
+        red = color == Color.RED
+        best = None
+        for move in board.generate_legal_moves(color):
+            board.make_move(move >> 7, move & 127)
+            score = self.tablebase_score(board, not red)
+            board.unmake_move()
+            if score is None:
+                return None
+            if best is None or (score > best[0] if red else score < best[0]):
+                best = (score, move)
+        return best
 
     def handle_gameover(self, board: Board, color: Color):
         board.debug = True
@@ -100,68 +544,281 @@ class Engine:
         board.debug = self.debug
         return None
 
+    def search_move(self, board: Board, move: int, depth: int, alpha: float, beta: float,
+                    maximizing_player: bool, scout: bool) -> float:
+        """
+        Principal variation search of one move. With scout the move is first searched with a null
+        window on the bound it has to improve and again with (alpha, beta) only when it does.
+        """
+        from_sq = move >> 7
+        to_sq = move & 127
+        if not scout or not self.pvs:
+            return self.minimax(board, from_sq, to_sq, depth, alpha, beta, maximizing_player)
+
+        self.scouts += 1
+        if maximizing_player:
+            value = self.minimax(board, from_sq, to_sq, depth, alpha, alpha + NULL_WINDOW, True)
+        else:
+            value = self.minimax(board, from_sq, to_sq, depth, beta - NULL_WINDOW, beta, False)
+        if alpha < value < beta:
+            self.pvs_researches += 1
+            value = self.minimax(board, from_sq, to_sq, depth, alpha, beta, maximizing_player)
+        return value
+
     def minimax(self, 
                board: Board,
-               from_pos: Vector,
-               to_pos: Vector,
+               from_sq: int,
+               to_sq: int,
                depth: int,
                alpha: float,
                beta: float,
                maximizing_player: bool) -> float:
-        return board.ghost_test(from_pos, to_pos, 
-                                lambda x: self.minimax_wrapper(x, depth-1, not maximizing_player, alpha, beta))
+        board.make_move(from_sq, to_sq)
+        value = self.minimax_wrapper(board, depth-1, not maximizing_player, alpha, beta)
+        board.unmake_move()
+        return value
 
     def minimax_wrapper(self,
                        board: Board,
                        depth: int,
                        maximizing_player: bool,
                        alpha: float,
-                       beta: float) -> float:
+                       beta: float,
+                       allow_null: bool = True) -> float:
         
         if self.debug:
             debcolor = Color.RED if maximizing_player else Color.BLACK
 
-        if depth == 1:
-            evaluate = board.evaluate(self.eval_set)
+        self.nodes += 1
+        if self.check_budget:
+            self.check_limits()
+
+        # a repetition is scored as a draw, the side ahead will avoid it
+        if board.repetitions():
+            return 0
+
+        # tablebase scores depend on the ply, the table keeps them relative to the node
+        ply = board.ply - self.root_ply
+        key = side_key(board.hash, maximizing_player)
+        entry = self.tt.probe(key)
+        tt_move = None
+        if entry is not None:
+            tt_depth, bound, score, tt_move = entry
+            score = _search_score(score, ply)
+            if tt_depth >= depth and (bound == EXACT or
+                                      (bound == LOWER and score >= beta) or
+                                      (bound == UPPER and score <= alpha)):
+                return score
+
+        if self.tablebases is not None:
+            score = self.tablebase_score(board, maximizing_player)
+            if score is not None:
+                return score
+
+        if depth <= 1:
+            if self.quiescence:
+                if self.profile:
+                    evaluate = self.timed(QUIESCENCE, self.quiescence_search, board, maximizing_player, alpha, beta, 0)
+                else:
+                    evaluate = self.quiescence_search(board, maximizing_player, alpha, beta, 0)
+                bound = UPPER if evaluate <= alpha else LOWER if evaluate >= beta else EXACT
+            else:
+                self.evaluations += 1
+                evaluate = self.timed(EVALUATION, board.evaluate, self.eval_set) if self.profile else board.evaluate(self.eval_set)
+                bound = EXACT
             if self.debug:
                 print(f"ENGINE WRAPPER: Evaluation = {evaluate}")
                 # board.print_visual()
+            self.tt.store(key, 1, bound, _tt_score(evaluate, ply), None)
             return evaluate
         
+        alpha_orig = alpha
+        beta_orig = beta
         extreme_value = -math.inf if maximizing_player else math.inf
-        pieces = board.get_reds() if maximizing_player else board.get_blacks()
-
-        for piece in pieces:
-            valid_moves = board.get_piece_valid_moves(piece, check=False)
-            for move in valid_moves:
-                if self.debug:
-                    print("--------------------------------------" * depth)
-                    print(f"MINIMAX {debcolor} with {piece.get_position()}->{move}")
-                    print(f"            depth={depth}, alpha={alpha}, beta={beta}")
-                current_value = self.minimax(
-                    board=board,
-                    from_pos=piece.get_position(),
-                    to_pos=move,
-                    depth=depth,
-                    alpha=alpha,
-                    beta=beta,
-                    maximizing_player=maximizing_player)
-                
-                if self.debug:
-                    print(f"MINIMAX EVALUATION for {debcolor} after {piece.get_position()}->{move}: {debcolor.opposite().name} can get {current_value}")
-                    print("--------------------------------------" * depth)
-
-                if maximizing_player:
-                    extreme_value = max(extreme_value, current_value)
-                    alpha = max(alpha, extreme_value)
-                else:
-                    extreme_value = min(extreme_value, current_value)
-                    beta = min(beta, extreme_value)
+        best_move = None
+        color = Color.RED if maximizing_player else Color.BLACK
+        in_check = (self.null_move or self.lmr) and depth >= min(NULL_MOVE_MIN_DEPTH, LMR_MIN_DEPTH) \
+            and board.in_check(color)
 
-                if beta <= alpha:
-                    break
+        if self.null_move and allow_null and not in_check and depth >= NULL_MOVE_MIN_DEPTH:
+            value = self.null_move_search(board, depth, maximizing_player, alpha, beta)
+            if value is not None:
+                self.tt.store(key, depth, LOWER if maximizing_player else UPPER, _tt_score(value, ply), None)
+                return value
+
+        self.movegen_calls += 1
+        if self.profile:
+            moves = self.timed(ORDERING, self.orderer.order, board, self.timed(MOVEGEN, board.generate_moves, color), ply, tt_move)
+        else:
+            moves = self.orderer.order(board, board.generate_moves(color), ply, tt_move)
+        reduce = self.lmr and not in_check and depth >= LMR_MIN_DEPTH
+        cells = board.cells
+
+        for index, move in enumerate(moves):
+            from_sq = move >> 7
+            to_sq = move & 127
+            if self.debug:
+                print("--------------------------------------" * depth)
+                print(f"MINIMAX {debcolor} with {SQUARE_VECTORS[from_sq]}->{SQUARE_VECTORS[to_sq]}")
+                print(f"            depth={depth}, alpha={alpha}, beta={beta}")
+            if reduce and index >= LMR_FULL_MOVES and cells[to_sq] == EMPTY:
+                current_value = self.reduced_search(board, move, depth, alpha, beta, maximizing_player)
+            else:
+                current_value = self.search_move(board, move, depth, alpha, beta, maximizing_player, index > 0)
+
+            if self.debug:
+                print(f"MINIMAX EVALUATION for {debcolor} after {SQUARE_VECTORS[from_sq]}->{SQUARE_VECTORS[to_sq]}: {debcolor.opposite().name} can get {current_value}")
+                print("--------------------------------------" * depth)
+
+            if maximizing_player:
+                if current_value > extreme_value:
+                    extreme_value = current_value
+                    best_move = move
+                alpha = max(alpha, extreme_value)
+            else:
+                if current_value < extreme_value:
+                    extreme_value = current_value
+                    best_move = move
+                beta = min(beta, extreme_value)
+
+            if beta <= alpha:
+                self.orderer.record_cutoff(board, move, ply, depth, index)
+                break
+
+        if extreme_value <= alpha_orig:
+            bound = UPPER
+        elif extreme_value >= beta_orig:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, bound, _tt_score(extreme_value, ply), best_move)
+        return extreme_value
+    def null_move_search(self, board: Board, depth: int, maximizing_player: bool,
+                         alpha: float, beta: float) -> Optional[float]:
+        """
+        Passes the turn and searches null_reduction plies shallower with a null window on beta
+        (alpha for BLACK). Returns the bound when even the pass fails high, otherwise None.
+        """
+        counts = board.counts
+        sign = 1 if maximizing_player else -1
+        if counts[SOLDIER + sign * CHARIOT] + counts[SOLDIER + sign * HORSE] + \
+                counts[SOLDIER + sign * CANNON] < NULL_MOVE_MIN_PIECES:
+            return None
+        if beta == math.inf if maximizing_player else alpha == -math.inf:
+            return None
+        # passing only refutes when the side to move is already doing well enough
+        self.evaluations += 1
+        static = self.timed(EVALUATION, board.evaluate, self.eval_set) if self.profile else board.evaluate(self.eval_set)
+        if static < beta if maximizing_player else static > alpha:
+            return None
+
+        self.null_tries += 1
+        board.make_null_move()
+        if maximizing_player:
+            value = self.minimax_wrapper(board, depth - 1 - self.null_reduction, False,
+                                         beta - NULL_WINDOW, beta, False)
+        else:
+            value = self.minimax_wrapper(board, depth - 1 - self.null_reduction, True,
+                                         alpha, alpha + NULL_WINDOW, False)
+        board.unmake_null_move()
+        if maximizing_player and value >= beta:
+            self.null_cutoffs += 1
+            # a mate found after passing is not proven for the real moves
+            return beta if value == math.inf else value
+        if not maximizing_player and value <= alpha:
+            self.null_cutoffs += 1
+            return alpha if value == -math.inf else value
+        return None
 
+    def reduced_search(self, board: Board, move: int, depth: int, alpha: float, beta: float,
+                       maximizing_player: bool) -> float:
+        """Late move reduction: a null window search lmr_reduction plies shallower, done again in full when it improves"""
+        self.reductions += 1
+        from_sq = move >> 7
+        to_sq = move & 127
+        if maximizing_player:
+            value = self.minimax(board, from_sq, to_sq, depth - self.lmr_reduction, alpha, alpha + NULL_WINDOW, True)
+            if value <= alpha:
+                return value
+        else:
+            value = self.minimax(board, from_sq, to_sq, depth - self.lmr_reduction, beta - NULL_WINDOW, beta, False)
+            if value >= beta:
+                return value
+        self.lmr_researches += 1
+        return self.search_move(board, move, depth, alpha, beta, maximizing_player, True)
+
+    def quiescence_search(self,
+                          board: Board,
+                          maximizing_player: bool,
+                          alpha: float,
+                          beta: float,
+                          qply: int) -> float:
+        """
+        Captures only, or all evasions when in check, until the position is quiet.
+        Stand pat: the side to move may keep the static evaluation instead of capturing.
+        Delta pruning: captures that cannot reach alpha (beta for BLACK) even with delta_margin are skipped.
+        """
+        self.qnodes += 1
+        if self.check_budget:
+            self.check_limits()
+
+        self.evaluations += 1
+        stand_pat = self.timed(EVALUATION, board.evaluate, self.eval_set) if self.profile else board.evaluate(self.eval_set)
+        if stand_pat == math.inf or stand_pat == -math.inf:
+            return stand_pat
+        color = Color.RED if maximizing_player else Color.BLACK
+        in_check = qply < QUIESCENCE_CHECK_PLIES and board.in_check(color)
+
+        if in_check:
+            self.movegen_calls += 1
+            moves = self.timed(MOVEGEN, board.generate_legal_moves, color) if self.profile else board.generate_legal_moves(color)
+            if not moves:
+                return -math.inf if maximizing_player else math.inf
+            extreme_value = -math.inf if maximizing_player else math.inf
+        else:
+            if maximizing_player:
+                if stand_pat >= beta:
+                    return stand_pat
+                alpha = max(alpha, stand_pat)
+            else:
+                if stand_pat <= alpha:
+                    return stand_pat
+                beta = min(beta, stand_pat)
+            extreme_value = stand_pat
+            self.movegen_calls += 1
+            moves = self.timed(MOVEGEN, board.generate_captures, color) if self.profile else board.generate_captures(color)
+        if self.profile:
+            moves = self.timed(ORDERING, self.orderer.order, board, moves, board.ply - self.root_ply)
+        else:
+            moves = self.orderer.order(board, moves, board.ply - self.root_ply)
+
+        cells = board.cells
+        capture_gains = self.capture_gains
+        for move in moves:
+            to_sq = move & 127
+            if not in_check:
+                gain = capture_gains[abs(cells[to_sq])]
+                if (stand_pat + gain <= alpha) if maximizing_player else (stand_pat - gain >= beta):
+                    continue
+            board.make_move(move >> 7, to_sq)
+            current_value = self.quiescence_search(board, not maximizing_player, alpha, beta, qply + 1)
+            board.unmake_move()
+
+            if maximizing_player:
+                extreme_value = max(extreme_value, current_value)
+                alpha = max(alpha, extreme_value)
+            else:
+                extreme_value = min(extreme_value, current_value)
+                beta = min(beta, extreme_value)
             if beta <= alpha:
                 break
 
-        return extreme_value
\ No newline at end of file
+        return extreme_value
+
+    def check_limits(self):
+        """Raises SearchAborted once the node (main + quiescence) or time budget is spent"""
+        nodes = self.nodes + self.qnodes
+        if self.max_nodes is not None and nodes >= self.max_nodes:
+            raise SearchAborted()
+        if self.deadline is not None and not nodes % TIME_CHECK_INTERVAL and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
@@ -0,0 +1,60 @@
+import json
+from supports import (Color, Vector, EvaluateSet, BOARD_WIDTH, BOARD_SIZE,
+                      GENERAL, ADVISOR, ELEPHANT, HORSE, CHARIOT, CANNON, SOLDIER)
+from pieces import General, Advisor, Elephant, Horse, Chariot, Cannon, Soldier
+
+# Piece-square bonuses seen from RED (y = 0 is RED's back rank), in piece value units.
+# Scaled by EvaluateSet.position_multiplier.
+def _red_bonus(kind: int, x: int, y: int) -> int:
+    central = x in (3, 4, 5)
+    if kind == SOLDIER:
+        if y < 5:
+            return 0
+        return (1 if y == 9 else 2 + min(y - 5, 2)) + (1 if central else 0)
+    if kind == HORSE:
+        return (1 if central else 0) + (1 if 5 <= y <= 8 else 0) - (1 if x in (0, 8) else 0)
+    if kind == CHARIOT:
+        return 1 if y >= 5 else 0
+    if kind == CANNON:
+        return 1 if x == 4 else 0
+    if kind == GENERAL:
+        return 0 if (x, y) == (4, 0) else -1
+    return 0
+
+# PIECE_SQUARE[code + SOLDIER][square]: bonus for the piece's own side, BLACK tables are mirrored
+PIECE_SQUARE = [[0] * BOARD_SIZE for _ in range(2 * SOLDIER + 1)]
+for _kind in (GENERAL, ADVISOR, ELEPHANT, HORSE, CHARIOT, CANNON, SOLDIER):
+    for _square in range(BOARD_SIZE):
+        _x = _square % BOARD_WIDTH
+        _y = _square // BOARD_WIDTH
+        PIECE_SQUARE[SOLDIER + _kind][_square] = _red_bonus(_kind, _x, _y)
+        PIECE_SQUARE[SOLDIER - _kind][_square] = _red_bonus(_kind, _x, 9 - _y)
+
+# names of the piece values in EvaluateSet files (see tuning)
+PIECE_NAMES = {GENERAL: "general", ADVISOR: "advisor", ELEPHANT: "elephant", HORSE: "horse",
+               CHARIOT: "chariot", CANNON: "cannon", SOLDIER: "soldier"}
+DEFAULT_PIECE_VALUES = {piece_class.code: piece_class(Color.RED, Vector(0, 0)).get_value()
+                        for piece_class in (General, Advisor, Elephant, Horse, Chariot, Cannon, Soldier)}
+
+def save_eval_set(path: str, eval_set: EvaluateSet, **extra):
+    """Writes the weights and the piece values by name as JSON, extra (K, loss, ...) alongside"""
+    data = dict(zip(("value_multiplier", "attack_bonus", "mobility_multiplier", "control_multiplier",
+                     "position_multiplier"), eval_set.get()))
+    values = eval_set.piece_values or DEFAULT_PIECE_VALUES
+    data["piece_values"] = {PIECE_NAMES[code]: float(value) for code, value in values.items()}
+    data.update(extra)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+def load_eval_set(path: str) -> EvaluateSet:
+    """EvaluateSet written by save_eval_set"""
+    with open(path) as f:
+        data = json.load(f)
+    codes = {name: code for code, name in PIECE_NAMES.items()}
+    values = None
+    if "piece_values" in data:
+        values = {codes[name]: value for name, value in data["piece_values"].items()}
+        if sorted(values) != sorted(PIECE_NAMES):
+            raise ValueError(f"{path}: piece_values needs a value for every piece")
+    return EvaluateSet(data["value_multiplier"], data["attack_bonus"], data["mobility_multiplier"],
+                       data["control_multiplier"], data["position_multiplier"], piece_values=values)
@@ -0,0 +1,89 @@
+"""
+Xiangqi FEN: ranks from BLACK's back rank (y = 9) down to RED's (y = 0), files x = 0..8,
+upper case RED, digits count empty squares, then side to move (w/r or b), two unused
+fields and the halfmove clock (moves without capture) and fullmove number.
+
+    rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w - - 0 1
+"""
+from typing import Tuple
+from board import Board
+from supports import (Color, BOARD_WIDTH, BOARD_HEIGHT, SQUARE_VECTORS,
+                      GENERAL, ADVISOR, ELEPHANT, HORSE, CHARIOT, CANNON, SOLDIER)
+from pieces import General, Advisor, Elephant, Horse, Chariot, Cannon, Soldier
+
+START_FEN = "rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w - - 0 1"
+
+PIECE_LETTERS = {GENERAL: "k", ADVISOR: "a", ELEPHANT: "b", HORSE: "n", CHARIOT: "r", CANNON: "c", SOLDIER: "p"}
+# letters read, with the g/e/h spellings some programs write for general, elephant and horse
+LETTER_CODES = {letter: code for code, letter in PIECE_LETTERS.items()}
+LETTER_CODES.update({"g": GENERAL, "e": ELEPHANT, "h": HORSE})
+PIECE_CLASSES = {GENERAL: General, ADVISOR: Advisor, ELEPHANT: Elephant, HORSE: Horse,
+                 CHARIOT: Chariot, CANNON: Cannon, SOLDIER: Soldier}
+
+def parse_fen(fen: str, debug: bool = False) -> Tuple[Board, Color]:
+    """Builds the board of a FEN, returns (board, side to move). Raises ValueError on a malformed FEN"""
+    fields = fen.split()
+    if not fields:
+        raise ValueError("Empty FEN")
+    ranks = fields[0].split("/")
+    if len(ranks) != BOARD_HEIGHT:
+        raise ValueError(f"FEN needs {BOARD_HEIGHT} ranks, got {len(ranks)}: {fen}")
+
+    pieces = []
+    for row, rank in enumerate(ranks):
+        y = BOARD_HEIGHT - 1 - row
+        x = 0
+        for char in rank:
+            if char.isdigit():
+                x += int(char)
+                continue
+            code = LETTER_CODES.get(char.lower())
+            if code is None or x >= BOARD_WIDTH:
+                raise ValueError(f"Bad rank '{rank}' in FEN: {fen}")
+            color = Color.RED if char.isupper() else Color.BLACK
+            pieces.append(PIECE_CLASSES[code](color, SQUARE_VECTORS[y * BOARD_WIDTH + x]))
+            x += 1
+        if x != BOARD_WIDTH:
+            raise ValueError(f"Rank '{rank}' does not have {BOARD_WIDTH} files in FEN: {fen}")
+
+    board = Board(debug=debug)
+    board.set_up(pieces)
+
+    side = fields[1] if len(fields) > 1 else "w"
+    if side in ("w", "r"):
+        color = Color.RED
+    elif side == "b":
+        color = Color.BLACK
+    else:
+        raise ValueError(f"Bad side to move '{side}' in FEN: {fen}")
+    try:
+        halfmove = int(fields[4]) if len(fields) > 4 else 0
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError(f"Bad move counters in FEN: {fen}")
+    board.uncapturing_moves_count = halfmove
+    board.initial_plies = 2 * (max(fullmove, 1) - 1) + (color == Color.BLACK)
+    return board, color
+
+def to_fen(board: Board, color: Color) -> str:
+    """FEN of the board with color to move"""
+    cells = board.cells
+    ranks = []
+    for y in range(BOARD_HEIGHT - 1, -1, -1):
+        rank = ""
+        empty = 0
+        for square in range(y * BOARD_WIDTH, (y + 1) * BOARD_WIDTH):
+            code = cells[square]
+            if not code:
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += PIECE_LETTERS[code].upper() if code > 0 else PIECE_LETTERS[-code]
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+    fullmove = 1 + (board.initial_plies + len(board.history)) // 2
+    side = "w" if color == Color.RED else "b"
+    return f"{'/'.join(ranks)} {side} - - {board.uncapturing_moves_count} {fullmove}"
@@ -1,22 +1,27 @@
 import pieces
-import pickle
 from board import Board
 from typing import List, Optional, Callable
-from supports import Vector, Color, textcolors, EvaluateSet
-from pieces import Chariot, Horse, Elephant, Advisor, General, Cannon, Soldier
+from supports import Vector, Color, textcolors, EvaluateSet, square_of
 from engine import Engine
+from fen import parse_fen, to_fen, START_FEN
+
+# saved game: the position as FEN (see fen)
+SAVE_FILE = 'board.fen'
+# puzzle=1 position: a lone RED chariot in the centre
+PUZZLE_FEN = "9/9/9/9/9/9/2R6/9/9/9 w - - 0 1"
 
 class Game:
-    def __init__(self, eval_set:EvaluateSet, puzzle = 0, load=False, debug=False):
+    def __init__(self, eval_set:EvaluateSet, puzzle = 0, load=False, debug=False, fen: Optional[str] = None):
         self.debug = debug
         self.board = Board(debug=debug)
         self.selected_piece: Optional['Piece'] = None
         self.last_move = (None, None)
         self.logs = open("game_log.txt", "w")
         self.eval_set = eval_set     
-        if load:
+        if fen is not None:
+            self.board, self.current_player_color = parse_fen(fen, debug=debug)
+        elif load:
             self.load_board()
-            self.load_current_color()
         else:
             if puzzle == 1:
                 self.puzzle()
@@ -29,40 +34,21 @@ class Game:
     def is_50moves_rule(self):
         return self.board.get_uncapturing_moves_count() >= 50
 
+    def is_repetition(self):
+        """The position stands on the board for the third time"""
+        return self.board.repetitions() >= 2
+
     def get_all(self):
         return self.board, self.last_move, self.selected_piece, self.current_player_color
 
     def initialize_pieces(self):
-        for i,color in enumerate(Color):
-            self.board.add_piece(General(color, Vector(4,9*i)))
-            for x,piece_class in enumerate([Chariot, Horse, Elephant, Advisor]):
-                self.board.add_piece(piece_class(color, Vector(x,9*i)))
-                self.board.add_piece(piece_class(color, Vector(8-x, 9*i)))
-            for x in range(5):
-                self.board.add_piece(Soldier(color, Vector(x*2, 3 + 3*i)))
-            self.board.add_piece(Cannon(color, Vector(1, 2 + 5*i)))
-            self.board.add_piece(Cannon(color, Vector(7, 2 + 5*i)))
+        self.board, _ = parse_fen(START_FEN, debug=self.debug)
         if self.debug:
             print("GAME: Board initialized successfully")
         return self.board
 
     def puzzle(self):
-        # # Красные фигуры (нижняя часть доски)
-        # self.board.add_piece(General(Color.RED, Vector(4, 0)))  # Генерал
-        # self.board.add_piece(Advisor(Color.RED, Vector(3, 0)))  # Советник
-        self.board.add_piece(Chariot(Color.RED, Vector(2, 3)))  # Ладья вышла в центр
-        # self.board.add_piece(Horse(Color.RED, Vector(7, 3)))    # Конь активно участвует
-        # self.board.add_piece(Cannon(Color.RED, Vector(7, 2)))   # Пушка на своей половине
-        # self.board.add_piece(Soldier(Color.RED, Vector(3, 7)))  # Солдат прорвался
-
-        # # Черные фигуры (верхняя часть доски)
-        # self.board.add_piece(General(Color.BLACK, Vector(5, 9)))  # Генерал
-        # self.board.add_piece(Advisor(Color.BLACK, Vector(4, 8)))  # Советник защищает
-        # # self.board.add_piece(Chariot(Color.BLACK, Vector(8, 7)))  # Ладья контролирует фланг
-        # self.board.add_piece(Horse(Color.BLACK, Vector(1, 7)))    # Конь в защите
-        # self.board.add_piece(Cannon(Color.BLACK, Vector(1, 8)))   # Пушка на задней линии
-        # self.board.add_piece(Soldier(Color.BLACK, Vector(4, 5)))  # Солдат в центре
-        # # self.board.add_piece(Chariot(Color.RED, Vector(5,2)))
+        self.board, _ = parse_fen(PUZZLE_FEN, debug=self.debug)
         return self.board
 
     def create_queue(self):
@@ -75,7 +61,7 @@ class Game:
         if self.debug and self.selected_piece is not None:
             print(f"GAME trying to select on {position}: piece already selected>> {self.selected_piece}")
             return False
-        piece = self.board.get_square(position).get_piece()
+        piece = self.board.get_piece(position)
         if piece and piece.get_color() == self.current_player_color:
             self.selected_piece = piece
             if self.debug:
@@ -94,7 +80,7 @@ class Game:
             if self.debug:
                 print(f"Valid moves: {valid_moves}")
         if (not check) or (new_position in valid_moves):
-            self.board.move_piece(self.selected_piece.get_position(), new_position)
+            self.board.move_piece(self.selected_piece.get_square(), square_of(new_position))
             print(f"GAME: moving {self.selected_piece}")
             self.logs.write(f"MOVE: {self.current_player_color.name} {self.selected_piece.get_name()} to {self.selected_piece.get_position()}\n")
             print(f"GAME: uncaptured: {self.board.get_uncapturing_moves_count()}")
@@ -123,12 +109,12 @@ class Game:
         #self.board.print_control()
         return self.board.print_visual()
 
+    def to_fen(self) -> str:
+        return to_fen(self.board, self.current_player_color)
+
     def save_board(self):
-        with open('board.pkl', 'wb') as f:
-            pack = self.board.get_reds() + self.board.get_blacks()
-            pickle.dump(pack, f)
-        with open('color2move.pkl', 'wb') as f:
-            pickle.dump(self.current_player_color, f)
+        with open(SAVE_FILE, 'w') as f:
+            f.write(self.to_fen() + "\n")
         self.logs.close()
         print("Board saved successfully")
 
@@ -136,25 +122,15 @@ class Game:
         return self.last_move
 
     def load_board(self):
+        """Loads the position and the side to move saved by save_board"""
         try:
-            with open('board.pkl', 'rb') as f:
-                pack = pickle.load(f)
-                for piece in pack:
-                    self.board.add_piece(piece)
+            with open(SAVE_FILE) as f:
+                self.board, self.current_player_color = parse_fen(f.read(), debug=self.debug)
                 print("Board loaded successfully")
                 return True
         except FileNotFoundError:
             print("No saved board found")
             self.initialize_pieces()
-            return False
-    def load_current_color(self):
-        try:
-            with open('color2move.pkl', 'rb') as f:
-                self.current_player_color = pickle.load(f)
-                print("Current color loaded successfully")
-                return True
-        except FileNotFoundError:
-            print("No saved color found")
             self.current_player_color = Color.RED
             return False
 
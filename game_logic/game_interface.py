@@ -4,6 +4,10 @@ from engine import Engine
 from typing import Optional
 from supports import Color, EvaluateSet, GameResult
 
+# bots deepen iteratively until their time per move is spent, up to this depth
+BOT_MOVE_SECONDS = 2.0
+BOT_MAX_DEPTH = 10
+
 class GameInterface:
     def __init__(self):
         self.default_eval_set = EvaluateSet(control_multiplier=0, mobility_multiplier=0)
@@ -11,6 +15,8 @@ class GameInterface:
         self.default_engine = Engine(self.default_eval_set, depth=1)  # For deep analysis
         self.red_player : Optional['Player'] = None
         self.black_player : Optional['Player'] = None
+        # print the engine counters after every bot move
+        self.show_search_stats = False
 
     def get_all_of_game(self):
         return self.game.get_all()
@@ -25,14 +31,17 @@ class GameInterface:
             self.game.print()
             current_player = self.red_player if self.game.current_player_color == Color.RED else self.black_player
             print(f"\nMOVE {i//2}:\n  {current_player.name}'s turn")
-            if len(self.game.board.get_attackers(self.game.current_player_color)) < 4:
-                current_player.add_depth(1)
             success = current_player.turn(self.game)
+            if self.show_search_stats and isinstance(current_player, Bot):
+                print(f"  search: {current_player.last_search_stats}")
             if not success:
                 break
             if self.game.is_50moves_rule():
                 print("TIE")
                 return GameResult.tie
+            if self.game.is_repetition():
+                print("TIE by repetition")
+                return GameResult.tie
             i += 1
 
         self.game.save_board()
@@ -61,7 +70,8 @@ class GameInterface:
         human1 = Human(name="Alice", color=Color.RED, profile_url="https://example.com/alice")
         human2 = Human(name="PALICE", color=Color.BLACK, profile_url="https://example.com/alice")
     
-        bot_engine1 = Engine(EvaluateSet(value_multiplier=100, attack_bonus=100, mobility_multiplier=1, control_multiplier=1), depth=2)
+        bot_engine1 = Engine(EvaluateSet(value_multiplier=100, attack_bonus=100, mobility_multiplier=1, control_multiplier=1),
+                             depth=BOT_MAX_DEPTH, time_limit=BOT_MOVE_SECONDS)
         ai1 = Bot(
             engine=bot_engine1,
             color=Color.RED,
@@ -69,7 +79,8 @@ class GameInterface:
             strategy_description="Prefers attacking moves"
         )
 
-        bot_engine2 = Engine(EvaluateSet(value_multiplier=100, attack_bonus=0, mobility_multiplier=1, control_multiplier=100), depth=2)
+        bot_engine2 = Engine(EvaluateSet(value_multiplier=100, attack_bonus=0, mobility_multiplier=1, control_multiplier=100),
+                             depth=BOT_MAX_DEPTH, time_limit=BOT_MOVE_SECONDS)
         ai2 = Bot(
             engine=bot_engine2,
             name="Defensive AI",
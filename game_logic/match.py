@@ -0,0 +1,314 @@
+"""
+Headless engine matches: games between two engine configurations played in a process pool,
+in pairs from the same opening with colours swapped, nothing printed while they run.
+
+An engine configuration is a dict of Engine arguments plus "name"; "eval_set" may be a dict of
+EvaluateSet arguments or the path of a tuned set (evaluation.load_eval_set), "book" and
+"tablebases" are paths.
+
+    python match.py --a '{"depth": 3}' --b '{"depth": 2}' --games 200 --workers 8 --json result.json
+    python match.py --a '{"depth": 3, "eval_set": "tuned.json"}' --b '{"depth": 3}' --corpus games.txt
+
+Openings: random_plies random legal moves from the start position, or a FEN per line of an
+openings file, both chosen by pair number so a match is repeatable. A game ends in mate
+(no legal move), a draw by repetition or the 50 move rule of Game, or a draw at max_plies.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from engine import Engine
+from book import OpeningBook
+from tablebase import Tablebases
+from supports import Color, EvaluateSet, square_of
+from evaluation import load_eval_set
+from fen import parse_fen, to_fen, START_FEN
+
+DEFAULT_RANDOM_PLIES = 8
+DEFAULT_MAX_PLIES = 300
+# plies without capture that end a game, as Game.is_50moves_rule
+DRAW_PLIES = 50
+
+def make_engine(config: dict) -> Engine:
+    """Engine of a configuration, see the module doc"""
+    arguments = {name: value for name, value in config.items() if name != "name"}
+    eval_set = arguments.get("eval_set")
+    if isinstance(eval_set, str):
+        arguments["eval_set"] = load_eval_set(eval_set)
+    elif isinstance(eval_set, dict):
+        arguments["eval_set"] = EvaluateSet(**eval_set)
+    elif eval_set is None:
+        arguments["eval_set"] = EvaluateSet()
+    if isinstance(arguments.get("book"), str):
+        arguments["book"] = OpeningBook(arguments["book"])
+    if isinstance(arguments.get("tablebases"), str):
+        arguments["tablebases"] = Tablebases(arguments["tablebases"])
+    return Engine(**arguments)
+
+def random_opening(plies: int, seed: int) -> str:
+    """FEN after plies random legal moves from the start position"""
+    rng = random.Random(seed)
+    board, color = parse_fen(START_FEN)
+    for _ in range(plies):
+        moves = board.generate_legal_moves(color)
+        if not moves:
+            break
+        move = rng.choice(moves)
+        board.make_move(move >> 7, move & 127)
+        color = color.opposite()
+    return to_fen(board, color)
+
+def play_game(red: dict, black: dict, fen: str, max_plies: int = DEFAULT_MAX_PLIES,
+              positions: bool = False) -> dict:
+    """
+    One game between two configurations from fen, each with a fresh engine.
+    Returns its record: result for RED (1, 0.5, 0), reason, plies, and per side (RED, BLACK)
+    moves, seconds and nodes; with positions also the FEN before every move
+    """
+    engines = (make_engine(red), make_engine(black))
+    board, color = parse_fen(fen)
+    moves = [0, 0]
+    seconds = [0.0, 0.0]
+    nodes = [0, 0]
+    fens = []
+    result = 0.5
+    reason = "max plies"
+    for _ in range(max_plies):
+        if not board.generate_legal_moves(color):
+            result = 0.0 if color == Color.RED else 1.0
+            reason = "mate"
+            break
+        if board.repetitions() >= 2:
+            reason = "repetition"
+            break
+        if board.uncapturing_moves_count >= DRAW_PLIES:
+            reason = "50 moves"
+            break
+        if positions:
+            fens.append(to_fen(board, color))
+        side = 0 if color == Color.RED else 1
+        start = time.perf_counter()
+        _, best_move, stats = engines[side].get_best_move(board, color, return_stats=True)
+        seconds[side] += time.perf_counter() - start
+        moves[side] += 1
+        nodes[side] += stats.nodes + stats.qnodes
+        board.make_move(square_of(best_move[0]), square_of(best_move[1]))
+        color = color.opposite()
+    for engine in engines:
+        engine.close()
+        if engine.book is not None:
+            engine.book.close()
+        if engine.tablebases is not None:
+            engine.tablebases.close()
+    record = {"fen": fen, "result": result, "reason": reason, "plies": len(board.history),
+              "moves": moves, "seconds": seconds, "nodes": nodes}
+    if positions:
+        record["positions"] = fens
+    return record
+
+def _play_pair(task) -> Tuple[int, List[dict]]:
+    """Both games of a pair from one opening, engine A as RED first. Records get "a_red" and "score" (for A)"""
+    pair, engine_a, engine_b, fen, max_plies, positions = task
+    games = []
+    for a_red in (True, False):
+        red, black = (engine_a, engine_b) if a_red else (engine_b, engine_a)
+        record = play_game(red, black, fen, max_plies, positions)
+        record["pair"] = pair
+        record["a_red"] = a_red
+        record["score"] = record["result"] if a_red else 1 - record["result"]
+        games.append(record)
+    return pair, games
+
+class MatchSummary:
+    """Results of engine A against engine B, added pair by pair"""
+    def __init__(self, name_a: str = "A", name_b: str = "B"):
+        self.names = (name_a, name_b)
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        # pairs by A's points in them, 0, 0.5, ..., 2 (the pentanomial counts)
+        self.pairs = [0] * 5
+        self.reasons: Dict[str, int] = {}
+        self.plies = 0
+        # per engine, index 0 = A
+        self.moves = [0, 0]
+        self.seconds = [0.0, 0.0]
+        self.nodes = [0, 0]
+
+    @property
+    def games(self) -> int:
+        return self.wins + self.draws + self.losses
+
+    def add_pair(self, games: List[dict]):
+        points = 0.0
+        for record in games:
+            score = record["score"]
+            points += score
+            if score == 1:
+                self.wins += 1
+            elif score == 0:
+                self.losses += 1
+            else:
+                self.draws += 1
+            self.reasons[record["reason"]] = self.reasons.get(record["reason"], 0) + 1
+            self.plies += record["plies"]
+            # RED's numbers are index 0 of the record
+            for engine, side in ((0, 0 if record["a_red"] else 1), (1, 1 if record["a_red"] else 0)):
+                self.moves[engine] += record["moves"][side]
+                self.seconds[engine] += record["seconds"][side]
+                self.nodes[engine] += record["nodes"][side]
+        self.pairs[round(points * 2)] += 1
+
+    def score(self) -> float:
+        """A's mean points per game"""
+        return (self.wins + self.draws / 2) / self.games if self.games else 0.5
+
+    def move_time(self, engine: int) -> float:
+        return self.seconds[engine] / self.moves[engine] if self.moves[engine] else 0.0
+
+    def move_nodes(self, engine: int) -> float:
+        return self.nodes[engine] / self.moves[engine] if self.moves[engine] else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "engines": list(self.names),
+            "games": self.games, "wins": self.wins, "draws": self.draws, "losses": self.losses,
+            "score": self.score(),
+            "pairs": list(self.pairs),
+            "reasons": dict(self.reasons),
+            "average_plies": self.plies / self.games if self.games else 0.0,
+            "move_time": [self.move_time(0), self.move_time(1)],
+            "move_nodes": [self.move_nodes(0), self.move_nodes(1)],
+            "totals": {"plies": self.plies, "moves": list(self.moves), "seconds": list(self.seconds),
+                       "nodes": list(self.nodes)},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'MatchSummary':
+        """Summary saved by as_dict"""
+        summary = cls(*data["engines"])
+        summary.wins = data["wins"]
+        summary.draws = data["draws"]
+        summary.losses = data["losses"]
+        summary.pairs = list(data["pairs"])
+        summary.reasons = dict(data["reasons"])
+        totals = data["totals"]
+        summary.plies = totals["plies"]
+        summary.moves = list(totals["moves"])
+        summary.seconds = list(totals["seconds"])
+        summary.nodes = list(totals["nodes"])
+        return summary
+
+    def __str__(self):
+        lines = [f"{self.names[0]} vs {self.names[1]}: +{self.wins} ={self.draws} -{self.losses} "
+                 f"({self.score():.1%} of {self.games} games)",
+                 "  " + ", ".join(f"{reason} {count}" for reason, count in sorted(self.reasons.items()))]
+        for engine in (0, 1):
+            lines.append(f"  {self.names[engine]}: {self.move_time(engine) * 1000:.1f} ms/move, "
+                         f"{self.move_nodes(engine):.0f} nodes/move")
+        return "\n".join(lines)
+
+class MatchRunner:
+    """Plays pairs of games between two configurations in a process pool"""
+    def __init__(self, engine_a: dict, engine_b: dict, workers: Optional[int] = None,
+                 openings: Optional[List[str]] = None, random_plies: int = DEFAULT_RANDOM_PLIES,
+                 max_plies: int = DEFAULT_MAX_PLIES, seed: int = 0, positions: bool = False):
+        """
+        params: workers: processes, the CPU count by default; 1 plays in this process
+                openings: FENs used in turn by pair number, random openings when None
+                random_plies: length of the random openings
+                positions: keep the FEN before every move in the records (tuning corpus)
+        """
+        self.engine_a = dict(engine_a)
+        self.engine_b = dict(engine_b)
+        self.engine_a.setdefault("name", "A")
+        self.engine_b.setdefault("name", "B")
+        self.workers = workers or os.cpu_count() or 1
+        if self.workers > 1 and max(self.engine_a.get("workers", 1), self.engine_b.get("workers", 1)) > 1:
+            raise ValueError("Engines cannot split their search over processes inside a match pool, use workers=1")
+        self.openings = openings
+        self.random_plies = random_plies
+        self.max_plies = max_plies
+        self.seed = seed
+        self.positions = positions
+        self.pool = None
+
+    def opening(self, pair: int) -> str:
+        if self.openings:
+            return self.openings[pair % len(self.openings)]
+        return random_opening(self.random_plies, self.seed * 1_000_003 + pair)
+
+    def play(self, pairs: Iterable[int]) -> Iterator[Tuple[int, List[dict]]]:
+        """(pair number, game records) of the pairs numbered as pairs, as they finish, in any order"""
+        tasks = ((pair, self.engine_a, self.engine_b, self.opening(pair), self.max_plies, self.positions)
+                 for pair in pairs)
+        if self.workers == 1:
+            yield from map(_play_pair, tasks)
+            return
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+        yield from self.pool.imap_unordered(_play_pair, tasks)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+def write_corpus(f, games: List[dict]):
+    """Appends the positions of finished games as tuning lines, 'FEN | result for RED'"""
+    for record in games:
+        for fen in record.get("positions", []):
+            f.write(f"{fen} | {record['result']}\n")
+
+def run_match(engine_a: dict, engine_b: dict, games: int, corpus: Optional[str] = None, **options) -> MatchSummary:
+    """games (rounded up to pairs) between engine_a and engine_b, options as MatchRunner"""
+    runner = MatchRunner(engine_a, engine_b, positions=corpus is not None, **options)
+    summary = MatchSummary(runner.engine_a["name"], runner.engine_b["name"])
+    corpus_file = open(corpus, "a") if corpus is not None else None
+    try:
+        for _, records in runner.play(range((games + 1) // 2)):
+            summary.add_pair(records)
+            if corpus_file is not None:
+                write_corpus(corpus_file, records)
+    finally:
+        runner.close()
+        if corpus_file is not None:
+            corpus_file.close()
+    return summary
+
+def read_openings(path: str) -> List[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def read_config(text: str) -> dict:
+    """An engine configuration from JSON text or a JSON file"""
+    if os.path.exists(text):
+        with open(text) as f:
+            return json.load(f)
+    return json.loads(text)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Engine against engine match")
+    parser.add_argument("--a", required=True, help="engine A configuration, JSON or a JSON file")
+    parser.add_argument("--b", required=True, help="engine B configuration, JSON or a JSON file")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--openings", help="file with one FEN per line")
+    parser.add_argument("--random-plies", type=int, default=DEFAULT_RANDOM_PLIES)
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", help="append the positions with the game results here (tuning)")
+    parser.add_argument("--json", help="write the summary here")
+    args = parser.parse_args()
+
+    summary = run_match(read_config(args.a), read_config(args.b), args.games, corpus=args.corpus,
+                        workers=args.workers, openings=read_openings(args.openings) if args.openings else None,
+                        random_plies=args.random_plies, max_plies=args.max_plies, seed=args.seed)
+    print(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary.as_dict(), f, indent=2)
@@ -0,0 +1,105 @@
+from typing import List, Optional
+from board import Board
+from supports import Color, SQUARE_VECTORS, SOLDIER
+from pieces import General, Advisor, Elephant, Horse, Chariot, Cannon, Soldier
+
+# piece value by unsigned piece code, taken from the piece classes
+PIECE_VALUES = [0] * (SOLDIER + 1)
+for _piece_class in (General, Advisor, Elephant, Horse, Chariot, Cannon, Soldier):
+    PIECE_VALUES[_piece_class.code] = _piece_class(Color.RED, SQUARE_VECTORS[0]).get_value()
+
+TT_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 24
+KILLER_SCORE = 1 << 22
+# history scores are halved once one of them reaches this, so quiet moves stay below killers
+HISTORY_LIMIT = 1 << 20
+# packed moves are below 1 << 14 (see supports)
+MOVE_SPACE = 1 << 14
+
+class MoveOrderer:
+    """
+    Orders moves at every node: TT move, captures by MVV-LVA, killer moves of the ply,
+    then quiet moves by history score. Counts beta cutoffs to measure how good the order is.
+    Subclass and override score() to try another scheme; the flags switch parts off.
+    """
+    def __init__(self, use_mvv_lva: bool = True, use_killers: bool = True, use_history: bool = True,
+                 max_ply: int = 128):
+        self.use_mvv_lva = use_mvv_lva
+        self.use_killers = use_killers
+        self.use_history = use_history
+        self.max_ply = max_ply
+        self.killers = [[0, 0] for _ in range(max_ply)]
+        # history[0] for RED moves, history[1] for BLACK
+        self.history = [[0] * MOVE_SPACE, [0] * MOVE_SPACE]
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def new_search(self):
+        """Killers belong to one position, history is kept but aged"""
+        self.killers = [[0, 0] for _ in range(self.max_ply)]
+        for table in self.history:
+            for move in range(MOVE_SPACE):
+                if table[move]:
+                    table[move] >>= 1
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def score(self, board: Board, move: int, ply: int, tt_move: Optional[int]) -> int:
+        if move == tt_move:
+            return TT_MOVE_SCORE
+        cells = board.cells
+        victim = cells[move & 127]
+        if victim:
+            if not self.use_mvv_lva:
+                return CAPTURE_SCORE
+            attacker = cells[move >> 7]
+            return CAPTURE_SCORE + PIECE_VALUES[abs(victim)] * 256 - PIECE_VALUES[abs(attacker)]
+        if self.use_killers and ply < self.max_ply:
+            killers = self.killers[ply]
+            if move == killers[0]:
+                return KILLER_SCORE + 1
+            if move == killers[1]:
+                return KILLER_SCORE
+        if self.use_history:
+            return self.history[0 if cells[move >> 7] > 0 else 1][move]
+        return 0
+
+    def order(self, board: Board, moves: List[int], ply: int, tt_move: Optional[int] = None) -> List[int]:
+        scored = [(self.score(board, move, ply, tt_move), move) for move in moves]
+        scored.sort(reverse=True)
+        return [move for score, move in scored]
+
+    def record_cutoff(self, board: Board, move: int, ply: int, depth: int, index: int):
+        """Called after move (the index-th one searched) failed high and was taken back"""
+        self.cutoffs += 1
+        if index == 0:
+            self.first_move_cutoffs += 1
+        cells = board.cells
+        if cells[move & 127]:
+            return
+        if self.use_killers and ply < self.max_ply:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        if self.use_history:
+            table = self.history[0 if cells[move >> 7] > 0 else 1]
+            table[move] += depth * depth
+            if table[move] >= HISTORY_LIMIT:
+                for other in range(MOVE_SPACE):
+                    table[other] >>= 1
+
+    def cutoff_rate(self) -> float:
+        """Share of beta cutoffs produced by the first move searched"""
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+class UnorderedMoves(MoveOrderer):
+    """Generation order, TT move first: the reference to measure orderers against"""
+    def __init__(self):
+        super().__init__(use_mvv_lva=False, use_killers=False, use_history=False)
+
+    def order(self, board: Board, moves: List[int], ply: int, tt_move: Optional[int] = None) -> List[int]:
+        if tt_move in moves:
+            moves.remove(tt_move)
+            moves.insert(0, tt_move)
+        return moves
@@ -0,0 +1,76 @@
+from typing import List, Tuple
+from supports import Color, BOARD_WIDTH, BOARD_HEIGHT, BOARD_SIZE, SQUARE_VECTORS, square_of, SOLDIER
+from pieces import General, Advisor, Elephant, Horse, Soldier
+
+# Per-square move tables of the pieces that step rather than slide, built once at import
+# from the Move/area descriptions in pieces.py.
+LEAPERS = (General, Advisor, Elephant, Horse, Soldier)
+
+def _leaper_table(piece_class, color: Color) -> List[List[Tuple[int, int]]]:
+    """For every square: (target square, blocking leg/eye square or -1) of each step"""
+    table = []
+    for square in range(BOARD_SIZE):
+        position = SQUARE_VECTORS[square]
+        piece = piece_class(color, position)
+        move = piece.get_move()
+        area = piece.get_area()
+        steps = []
+        for direction in move.get_directions():
+            target = position + direction
+            if not target.in_area(area):
+                continue
+            block = square_of(position + direction // 2) if move.is_bigstep() else -1
+            steps.append((square_of(target), block))
+        table.append(steps)
+    return table
+
+# LEAPER_MOVES[code + SOLDIER][square], code is a signed piece code; None for sliding pieces
+LEAPER_MOVES: List[List[List[Tuple[int, int]]]] = [None] * (2 * SOLDIER + 1)
+for _piece_class in LEAPERS:
+    LEAPER_MOVES[SOLDIER + _piece_class.code] = _leaper_table(_piece_class, Color.RED)
+    LEAPER_MOVES[SOLDIER - _piece_class.code] = _leaper_table(_piece_class, Color.BLACK)
+
+# HORSE_CHECKS[square]: (horse square, leg square) of every horse that could jump onto square
+HORSE_CHECKS: List[List[Tuple[int, int]]] = [[] for _ in range(BOARD_SIZE)]
+for _square, _steps in enumerate(LEAPER_MOVES[SOLDIER + Horse.code]):
+    for _target, _leg in _steps:
+        HORSE_CHECKS[_target].append((_square, _leg))
+
+# Sliding pieces: everything a chariot or cannon sees along one rank or file depends only on
+# its position in the line and the occupancy bitmask of the line. SLIDES[position][occupancy]
+# holds four tuples of line positions, both directions together:
+SLIDE_EMPTY = 0      # empty squares before the first piece: chariot and cannon quiet moves
+SLIDE_BLOCKERS = 1   # first piece: chariot captures, facing generals
+SLIDE_SCREENED = 2   # second piece, behind a screen: cannon captures
+SLIDE_BEHIND = 3     # empty squares between the first and second piece: cannon control
+
+def _slides(position: int, occupancy: int, length: int, shared: dict) -> Tuple[Tuple[int, ...], ...]:
+    found = ([], [], [], [])
+    for step in (1, -1):
+        other = position + step
+        seen = 0
+        while 0 <= other < length:
+            if occupancy >> other & 1:
+                found[SLIDE_SCREENED if seen else SLIDE_BLOCKERS].append(other)
+                if seen:
+                    break
+                seen = 1
+            else:
+                found[SLIDE_BEHIND if seen else SLIDE_EMPTY].append(other)
+            other += step
+    # many lines look alike, share the tuples
+    return tuple(shared.setdefault(tuple(positions), tuple(positions)) for positions in found)
+
+def _slide_table(length: int):
+    shared = {}
+    return [[_slides(position, occupancy, length, shared) for occupancy in range(1 << length)]
+            for position in range(length)]
+
+# RANK_SLIDES[x][rank occupancy], FILE_SLIDES[y][file occupancy]; bit i of the occupancy = square i of the line
+RANK_SLIDES = _slide_table(BOARD_WIDTH)
+FILE_SLIDES = _slide_table(BOARD_HEIGHT)
+# line position -> square: RANK_SQUARES[y][x], FILE_SQUARES[x][y]
+RANK_SQUARES = [[y * BOARD_WIDTH + x for x in range(BOARD_WIDTH)] for y in range(BOARD_HEIGHT)]
+FILE_SQUARES = [[y * BOARD_WIDTH + x for y in range(BOARD_HEIGHT)] for x in range(BOARD_WIDTH)]
+SQUARE_X = [square % BOARD_WIDTH for square in range(BOARD_SIZE)]
+SQUARE_Y = [square // BOARD_WIDTH for square in range(BOARD_SIZE)]
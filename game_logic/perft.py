@@ -0,0 +1,133 @@
+"""
+Perft: counts the leaves of the legal move tree to a fixed depth, the correctness and
+speed gate of move generation.
+
+    python perft.py                      # every position against its reference counts
+    python perft.py -p cannon_screens -d 3 --divide
+    python perft.py --reference          # also count with the independent reference generator
+
+Only the start position counts are published values. The other counts were produced by this
+generator and confirmed by the reference one, which shares no check detection with it.
+"""
+import argparse
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from board import Board
+from supports import Color, SQUARE_VECTORS, BOARD_WIDTH, BOARD_SIZE, EMPTY, GENERAL
+from fen import parse_fen, START_FEN
+
+# name: (FEN, {depth: leaf count})
+# The start counts are the published Xiangqi perft numbers, the others were counted by both
+# generate_legal_moves and reference_moves and agree.
+POSITIONS: Dict[str, Tuple[str, Dict[int, int]]] = {
+    "start": (START_FEN, {1: 44, 2: 1920, 3: 79666, 4: 3290240}),
+    # cannons capturing over screens, a cannon check through a screen and a double screen
+    "cannon_screens": ("1n1ak4/9/1cb1c4/4P4/1R7/4C4/9/1C4Nr1/4A4/4K4 w - - 0 1", {1: 49, 2: 1214, 3: 53607}),
+    # generals on one file with a single piece between them, which may not leave the file
+    "flying_general": ("4ka3/r8/9/4n4/3R5/9/3p5/2N5C/9/3AK4 b - - 0 1", {1: 22, 2: 831, 3: 16528}),
+    # horses with blocked legs, horse checks that a leg block stops
+    "horse_legs": ("4k4/3na3r/3N5/6n2/4P1b2/4N4/9/5n3/5A3/2B1K4 w - - 0 1", {1: 19, 2: 614, 3: 11388}),
+    # soldiers across the river moving sideways, a soldier check and a soldier on the last rank
+    "crossed_soldiers": ("4ka2P/4P4/9/2P6/7p1/p4P3/9/3p5/R3p4/3K5 b - - 0 1", {1: 3, 2: 42, 3: 458}),
+}
+
+def legal_moves(board: Board, color: Color) -> List[int]:
+    return board.generate_legal_moves(color)
+
+def reference_in_check(board: Board, color: Color) -> bool:
+    """
+    Whether color's general can be taken, found without the board's check detection:
+    the general is looked up in the cells, then every enemy piece's targets are scanned
+    and the generals are tested for facing each other on an open file
+    """
+    cells = board.cells
+    general = GENERAL if color == Color.RED else -GENERAL
+    squares = [square for square in range(BOARD_SIZE) if cells[square] == general]
+    enemy_squares = [square for square in range(BOARD_SIZE) if cells[square] == -general]
+    if not squares:
+        return True
+    square = squares[0]
+    for enemy in (board.blacks if color == Color.RED else board.reds):
+        if square in board.piece_targets(enemy.square):
+            return True
+    if enemy_squares and enemy_squares[0] % BOARD_WIDTH == square % BOARD_WIDTH:
+        low, high = sorted((square, enemy_squares[0]))
+        if all(cells[between] == EMPTY for between in range(low + BOARD_WIDTH, high, BOARD_WIDTH)):
+            return True
+    return False
+
+def reference_moves(board: Board, color: Color) -> List[int]:
+    """Pseudo-legal moves filtered by playing each and testing reference_in_check, slow but independent"""
+    moves = []
+    for move in board.generate_moves(color):
+        board.make_move(move >> 7, move & 127)
+        if not reference_in_check(board, color):
+            moves.append(move)
+        board.unmake_move()
+    return moves
+
+def perft(board: Board, color: Color, depth: int,
+          generate: Callable[[Board, Color], List[int]] = legal_moves) -> int:
+    moves = generate(board, color)
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    opponent = color.opposite()
+    for move in moves:
+        board.make_move(move >> 7, move & 127)
+        nodes += perft(board, opponent, depth - 1, generate)
+        board.unmake_move()
+    return nodes
+
+def divide(board: Board, color: Color, depth: int,
+           generate: Callable[[Board, Color], List[int]] = legal_moves) -> List[Tuple[int, int]]:
+    """Leaf count below each root move: (move, nodes)"""
+    result = []
+    for move in generate(board, color):
+        board.make_move(move >> 7, move & 127)
+        result.append((move, perft(board, color.opposite(), depth - 1, generate)))
+        board.unmake_move()
+    return result
+
+def run(name: str, depth: Optional[int] = None, show_divide: bool = False, reference: bool = False) -> bool:
+    """Counts one position to depth (every depth with a reference count by default), returns False on a mismatch"""
+    fen, expected = POSITIONS[name]
+    board, color = parse_fen(fen)
+    depths = [depth] if depth is not None else sorted(expected)
+    ok = True
+    for d in depths:
+        start = time.perf_counter()
+        if show_divide:
+            counts = divide(board, color, d)
+            nodes = sum(count for _, count in counts)
+        else:
+            nodes = perft(board, color, d)
+        elapsed = time.perf_counter() - start
+        line = f"{name:18} depth {d}: {nodes:>10} nodes {elapsed:8.3f}s {nodes / elapsed if elapsed else 0:>10.0f} nodes/s"
+        if d in expected:
+            match = nodes == expected[d]
+            ok = ok and match
+            line += "  ok" if match else f"  MISMATCH, expected {expected[d]}"
+        if reference:
+            start = time.perf_counter()
+            slow = perft(board, color, d, reference_moves)
+            match = slow == nodes
+            ok = ok and match
+            line += f"  reference {slow} ({time.perf_counter() - start:.3f}s)" + ("" if match else " MISMATCH")
+        print(line)
+        if show_divide:
+            for move, count in sorted(counts, key=lambda item: (SQUARE_VECTORS[item[0] >> 7].x, SQUARE_VECTORS[item[0] >> 7].y, item[0])):
+                print(f"    {SQUARE_VECTORS[move >> 7]}->{SQUARE_VECTORS[move & 127]}: {count}")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perft of the Xiangqi move generator")
+    parser.add_argument("-p", "--position", choices=sorted(POSITIONS), help="one position instead of all")
+    parser.add_argument("-d", "--depth", type=int, help="one depth instead of the reference depths")
+    parser.add_argument("--divide", action="store_true", help="leaf count per root move")
+    parser.add_argument("--reference", action="store_true", help="also count with the reference generator")
+    args = parser.parse_args()
+    names = [args.position] if args.position else list(POSITIONS)
+    results = [run(name, args.depth, args.divide, args.reference) for name in names]
+    if not all(results):
+        raise SystemExit(1)
@@ -4,10 +4,14 @@ from supports import *
 #from supports import FULLBOARD_AREA, RED_PALACE_AREA, RED_HALF, BLACK_PALACE_AREA, Move, Color, Vector, textcolors
 
 class Piece:
+    code = EMPTY
+
     def __init__(self, color: Color, position: Vector, move: Move,
                  name: str, attacking: bool, value: float):
         self.color = color
-        self.position = position
+        self.square = square_of(position)
+        # index in the board's team list, kept by Board
+        self.slot = -1
         self.move = move
         self.name = name    
         self.attacking = attacking
@@ -17,14 +21,6 @@ class Piece:
         return FULLBOARD_AREA
     def need_screen(self):
         return False
-    def can_modify(self):
-        return False
-    def is_modified(self):
-        pass
-    def modify(self):
-        pass
-    def set_default(self):
-        pass
     def get_max_steps(self):
         pass
 
@@ -37,11 +33,30 @@ class Piece:
     def get_value(self):
         return self.value
 
+    @property
+    def position(self):
+        return SQUARE_VECTORS[self.square]
+
     def get_position(self):
-        return self.position
+        return SQUARE_VECTORS[self.square]
 
     def set_position(self, new_position: Vector):
-        self.position = new_position
+        self.square = square_of(new_position)
+
+    def get_square(self):
+        return self.square
+
+    def set_square(self, square: int):
+        self.square = square
+
+    def get_code(self):
+        return self.code if self.color == Color.RED else -self.code
+
+    def __setstate__(self, state):
+        # pieces pickled before the flat board stored a Vector position
+        if 'position' in state:
+            state['square'] = square_of(state.pop('position'))
+        self.__dict__.update(state)
     
     def get_color(self):
         return self.color
@@ -56,6 +71,8 @@ class Piece:
         return f"Piece {textcolors.red if self.color==Color.RED else textcolors.green}{self.name}{textcolors.endc} on position {self.position}"
 
 class General(Piece):
+    code = GENERAL
+
     def __init__(self, color: Color, position: Vector):
         move = Move([Vector(1, 0), Vector(-1, 0), Vector(0, 1), Vector(0, -1)])
         super().__init__(color, position, move, 'G', attacking=False, value=100)
@@ -67,6 +84,8 @@ class General(Piece):
         return 1
 
 class Advisor(Piece):
+    code = ADVISOR
+
     def __init__(self, color: Color, position: Vector):
         move = Move([Vector(1, 1), Vector(1, -1), Vector(-1, 1), Vector(-1, -1)])
         super().__init__(color, position, move, 'A', attacking=False, value=2)
@@ -78,6 +97,8 @@ class Advisor(Piece):
         return RED_PALACE_AREA if self.color==Color.RED else BLACK_PALACE_AREA
 
 class Chariot(Piece):
+    code = CHARIOT
+
     def __init__(self, color: Color, position: Vector):
         move = Move([Vector(1, 0), Vector(-1, 0), Vector(0, 1), Vector(0, -1)])
         super().__init__(color, position, move, 'R', attacking=True, value=9)
@@ -86,6 +107,8 @@ class Chariot(Piece):
         return 10
 
 class Horse(Piece):
+    code = HORSE
+
     def __init__(self, color: Color, position: Vector):
         move = Move([Vector(2, 1), Vector(2, -1), Vector(-2, 1), Vector(-2, -1), Vector(1, 2),
                      Vector(1, -2), Vector(-1, 2), Vector(-1, -2)], bigstep=True)
@@ -95,6 +118,8 @@ class Horse(Piece):
         return 1
 
 class Elephant(Piece):
+    code = ELEPHANT
+
     def __init__(self, color: Color, position: Vector):
         move = Move([Vector(2, 2), Vector(2, -2), Vector(-2, 2), Vector(-2, -2)], bigstep=True)
         super().__init__(color, position, move, 'E', attacking=False, value=2)
@@ -106,6 +131,8 @@ class Elephant(Piece):
         return RED_HALF if self.color==Color.RED else BLACK_HALF
 
 class Cannon(Piece):
+    code = CANNON
+
     def __init__(self, color: Color, position: Vector):
         move = Move([Vector(1, 0), Vector(-1, 0), Vector(0, 1), Vector(0, -1)])
         super().__init__(color, position, move, 'C', attacking=True, value=5)
@@ -116,28 +143,22 @@ class Cannon(Piece):
     def need_screen(self):
         return True
 
+# forward step only, and with the sideways steps allowed once the river is crossed
+_SOLDIER_MOVES = {color: (Move([forward]), Move([forward, Vector(-1, 0), Vector(1, 0)]))
+                  for color, forward in ((Color.RED, Vector(0, 1)), (Color.BLACK, Vector(0, -1)))}
+
 class Soldier(Piece):
+    code = SOLDIER
+
     def __init__(self, color: Color, position: Vector):
-        move = Move([Vector(0, 1)] if color==Color.RED else [Vector(0, -1)])
-        super().__init__(color, position, move, 'S', attacking=True, value=1)
-        self.modified = False
+        super().__init__(color, position, _SOLDIER_MOVES[color][0], 'S', attacking=True, value=1)
 
     def get_max_steps(self):
         return 1
 
-    def can_modify(self):
-        return True
-
-    def is_modified(self):
-        return self.modified
+    def has_crossed(self):
+        y = self.square // BOARD_WIDTH
+        return y > 4 if self.color == Color.RED else y < 5
 
-    def modify(self):
-        self.modified = True
-        self.move += Vector(-1,0)
-        self.move += Vector(1,0)
-        self.value = 2
-
-    def set_default(self):
-        self.modified = False
-        self.move = Move([Vector(0, 1)] if self.color==Color.RED else [Vector(0, -1)])
-        self.value = 1
\ No newline at end of file
+    def get_move(self):
+        return _SOLDIER_MOVES[self.color][1 if self.has_crossed() else 0]
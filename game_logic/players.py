@@ -1,6 +1,7 @@
 from typing import Optional, Dict, Any, Callable, Tuple
 from game_enviroment import Game
 from engine import Engine
+from search_stats import SearchStats
 from supports import Color, Vector
 import datetime
 
@@ -109,16 +110,27 @@ class Bot(Player):
         self.metadata.update({
             "type": "bot",
             "engine_depth": engine.depth,
+            "engine_time_limit": engine.time_limit,
+            "opening_book": engine.book.path if engine.book is not None else None,
+            "tablebases": engine.tablebases.directory if engine.tablebases is not None else None,
             "strategy": strategy_description
         })
+        # engine counters of the last move and summed over all moves
+        self.last_search_stats: Optional[SearchStats] = None
+        self.search_stats = SearchStats()
 
     def add_depth(self, change):
+        """Ignored when the engine has a time budget, the budget bounds the depth then"""
+        if self.engine.time_limit is not None:
+            return
         new_depth = self.engine.depth + change
         if new_depth <= 10:
             self.engine.depth = new_depth
 
     def turn(self, game: Game) -> bool:
-        my_eval, best_move = self.engine.get_best_move(game.board, self.color)
+        my_eval, best_move, search_stats = self.engine.get_best_move(game.board, self.color, return_stats=True)
+        self.last_search_stats = search_stats
+        self.search_stats.add(search_stats)
         if best_move is None:
             return False
 
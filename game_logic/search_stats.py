@@ -0,0 +1,64 @@
+from typing import Dict
+
+# phases timed by an Engine with profile=True; quiescence includes its own move generation and evaluation
+MOVEGEN = "movegen"
+ORDERING = "ordering"
+EVALUATION = "evaluation"
+QUIESCENCE = "quiescence"
+PHASES = (MOVEGEN, ORDERING, EVALUATION, QUIESCENCE)
+
+COUNTERS = ("nodes", "qnodes", "cutoffs", "first_move_cutoffs", "evaluations", "tt_probes", "tt_hits",
+            "movegen_calls", "scouts", "pvs_researches", "aspiration_researches", "null_tries", "null_cutoffs",
+            "reductions", "lmr_researches", "book_hits", "tablebase_hits")
+
+class SearchStats:
+    """
+    Counters of one Engine.get_best_move call, or a sum of several (see add).
+    phase_times holds seconds per phase and is empty unless the engine profiles.
+    """
+    def __init__(self):
+        self.searches = 0
+        self.depth = 0
+        self.seconds = 0.0
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        self.phase_times: Dict[str, float] = {}
+
+    def add(self, other: 'SearchStats'):
+        """Adds the counters of other, depth keeps the deepest search"""
+        self.searches += other.searches
+        self.depth = max(self.depth, other.depth)
+        self.seconds += other.seconds
+        for name in COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for phase, seconds in other.phase_times.items():
+            self.phase_times[phase] = self.phase_times.get(phase, 0.0) + seconds
+
+    def first_move_rate(self) -> float:
+        """Share of beta cutoffs made by the first move searched"""
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def tt_hit_rate(self) -> float:
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    def nps(self) -> float:
+        return (self.nodes + self.qnodes) / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        result = {"searches": self.searches, "depth": self.depth, "seconds": self.seconds}
+        for name in COUNTERS:
+            result[name] = getattr(self, name)
+        result["first_move_rate"] = self.first_move_rate()
+        result["tt_hit_rate"] = self.tt_hit_rate()
+        result["nps"] = self.nps()
+        result["phase_times"] = dict(self.phase_times)
+        return result
+
+    def __str__(self):
+        line = (f"depth {self.depth}, {self.nodes} nodes + {self.qnodes} qnodes in {self.seconds:.3f}s "
+                f"({self.nps():.0f} n/s), cutoffs {self.cutoffs} ({self.first_move_rate():.0%} first move), "
+                f"evals {self.evaluations}, movegen {self.movegen_calls}, "
+                f"TT {self.tt_hits}/{self.tt_probes} ({self.tt_hit_rate():.0%})")
+        if self.phase_times:
+            line += ", " + ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in self.phase_times.items())
+        return line
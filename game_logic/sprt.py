@@ -0,0 +1,216 @@
+"""
+Sequential probability ratio test of engine A against engine B on match.py pairs of games:
+plays until the log likelihood ratio of "A is elo1 stronger" against "A is elo0 stronger"
+crosses a bound, H1 accepted (A is better) or H0 accepted (it is not), or max_games run out.
+
+The LLR is the normal approximation on pentanomial pair scores (0, 0.5, ..., 2 points of A
+in a pair), which accounts for the two games of a pair sharing an opening. Elo is the
+logistic one, with a 95% interval.
+
+Progress is checkpointed to a JSON file; run the same command with only --checkpoint to resume.
+
+    python sprt.py --a '{"depth": 3, "eval_set": "tuned.json", "name": "tuned"}' --b '{"depth": 3}' \\
+        --elo0 0 --elo1 10 --checkpoint tuned.sprt.json --workers 8
+    python sprt.py --checkpoint tuned.sprt.json
+"""
+import argparse
+import json
+import math
+import os
+import time
+from typing import List, Optional, Tuple
+from match import MatchRunner, MatchSummary, read_config, read_openings, DEFAULT_RANDOM_PLIES, DEFAULT_MAX_PLIES
+
+H1 = "H1"
+H0 = "H0"
+# pair points of the pentanomial counts, per game
+PAIR_SCORES = (0.0, 0.25, 0.5, 0.75, 1.0)
+CHECKPOINT_SECONDS = 60.0
+DEFAULT_MAX_GAMES = 100_000
+
+def expected_score(elo: float) -> float:
+    return 1 / (1 + 10 ** (-elo / 400))
+
+def elo_of(score: float) -> float:
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+def pair_statistics(pairs: List[int]) -> Tuple[int, float, float]:
+    """(pairs, mean score per game, variance of a pair's mean score) of pentanomial counts"""
+    count = sum(pairs)
+    if not count:
+        return 0, 0.5, 0.0
+    mean = sum(n * score for n, score in zip(pairs, PAIR_SCORES)) / count
+    variance = sum(n * (score - mean) ** 2 for n, score in zip(pairs, PAIR_SCORES)) / count
+    return count, mean, variance
+
+def llr(pairs: List[int], elo0: float, elo1: float) -> float:
+    """Log likelihood ratio of elo1 against elo0 for the pentanomial counts"""
+    count, mean, variance = pair_statistics(pairs)
+    if not count or variance <= 0:
+        return 0.0
+    s0 = expected_score(elo0)
+    s1 = expected_score(elo1)
+    return count * (s1 - s0) * (2 * mean - s0 - s1) / (2 * variance)
+
+def elo_interval(pairs: List[int], z: float = 1.96) -> Tuple[float, float, float]:
+    """(Elo, lower, upper) of A against B, z = 1.96 for 95%"""
+    count, mean, variance = pair_statistics(pairs)
+    if not count:
+        return 0.0, -math.inf, math.inf
+    error = z * math.sqrt(variance / count)
+    return elo_of(mean), elo_of(mean - error), elo_of(mean + error)
+
+class SPRT:
+    def __init__(self, elo0: float = 0.0, elo1: float = 5.0, alpha: float = 0.05, beta: float = 0.05):
+        """
+        params: elo0, elo1: Elo of A over B under H0 and H1
+                alpha: chance of accepting H1 when H0 holds, beta: of accepting H0 when H1 holds
+        """
+        if elo1 <= elo0:
+            raise ValueError(f"elo1 must be above elo0: {elo0}, {elo1}")
+        if not (0 < alpha < 1 and 0 < beta < 1):
+            raise ValueError(f"alpha and beta must be in (0, 1): {alpha}, {beta}")
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.alpha = alpha
+        self.beta = beta
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+
+    def llr(self, pairs: List[int]) -> float:
+        return llr(pairs, self.elo0, self.elo1)
+
+    def decision(self, pairs: List[int]) -> Optional[str]:
+        """H1, H0 or None while the test goes on"""
+        value = self.llr(pairs)
+        if value >= self.upper:
+            return H1
+        if value <= self.lower:
+            return H0
+        return None
+
+    def as_dict(self) -> dict:
+        return {"elo0": self.elo0, "elo1": self.elo1, "alpha": self.alpha, "beta": self.beta}
+
+    def report(self, summary: MatchSummary) -> str:
+        elo, lower, upper = elo_interval(summary.pairs)
+        return (f"{summary}\n  Elo {elo:+.1f} [{lower:+.1f}, {upper:+.1f}], "
+                f"LLR {self.llr(summary.pairs):.2f} ({self.lower:.2f}, {self.upper:.2f}) "
+                f"for [{self.elo0:g}, {self.elo1:g}], pairs {summary.pairs}")
+
+class SPRTRun:
+    """A test in progress: the match, its results so far and the checkpoint file"""
+    def __init__(self, engine_a: dict, engine_b: dict, sprt: SPRT, checkpoint: Optional[str] = None,
+                 max_games: int = DEFAULT_MAX_GAMES, match_options: Optional[dict] = None):
+        """
+        params: match_options: MatchRunner arguments (workers, openings, random_plies, max_plies, seed)
+                checkpoint: JSON file written every CHECKPOINT_SECONDS, on stopping and on interrupt
+        """
+        self.sprt = sprt
+        self.checkpoint = checkpoint
+        self.max_games = max_games
+        self.match_options = dict(match_options or {})
+        self.runner = MatchRunner(engine_a, engine_b, **self.match_options)
+        self.summary = MatchSummary(self.runner.engine_a["name"], self.runner.engine_b["name"])
+        # pairs below next_pair are all played, done holds those played above it
+        self.next_pair = 0
+        self.done = set()
+        self.result: Optional[str] = None
+
+    @classmethod
+    def resume(cls, checkpoint: str) -> 'SPRTRun':
+        with open(checkpoint) as f:
+            data = json.load(f)
+        run = cls(data["engine_a"], data["engine_b"], SPRT(**data["sprt"]), checkpoint, data["max_games"],
+                  data["match"])
+        run.summary = MatchSummary.from_dict(data["summary"])
+        run.next_pair = data["next_pair"]
+        run.done = set(data["done"])
+        run.result = data["result"]
+        return run
+
+    def save(self):
+        if self.checkpoint is None:
+            return
+        data = {"engine_a": self.runner.engine_a, "engine_b": self.runner.engine_b, "sprt": self.sprt.as_dict(),
+                "max_games": self.max_games, "match": self.match_options, "summary": self.summary.as_dict(),
+                "next_pair": self.next_pair, "done": sorted(self.done), "result": self.result}
+        temporary = self.checkpoint + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temporary, self.checkpoint)
+
+    def pending(self):
+        """Pair numbers still to play, the ones skipped when the last run stopped first"""
+        pair = self.next_pair
+        while pair < (self.max_games + 1) // 2:
+            if pair not in self.done:
+                yield pair
+            pair += 1
+
+    def finish_pair(self, pair: int, games: List[dict]):
+        self.summary.add_pair(games)
+        self.done.add(pair)
+        while self.next_pair in self.done:
+            self.done.remove(self.next_pair)
+            self.next_pair += 1
+
+    def run(self, verbose: bool = True) -> Optional[str]:
+        """Plays until a decision or max_games, returns H1, H0 or None (no decision)"""
+        if self.result is None:
+            self.result = self.sprt.decision(self.summary.pairs)
+        saved = time.perf_counter()
+        try:
+            if self.result is None:
+                for pair, games in self.runner.play(self.pending()):
+                    self.finish_pair(pair, games)
+                    self.result = self.sprt.decision(self.summary.pairs)
+                    if self.result is not None:
+                        break
+                    if time.perf_counter() - saved >= CHECKPOINT_SECONDS:
+                        self.save()
+                        saved = time.perf_counter()
+                        if verbose:
+                            print(self.sprt.report(self.summary), flush=True)
+        finally:
+            self.runner.close()
+            self.save()
+        return self.result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SPRT of engine A against engine B")
+    parser.add_argument("--a", help="engine A configuration (the change), JSON or a JSON file")
+    parser.add_argument("--b", help="engine B configuration (the base), JSON or a JSON file")
+    parser.add_argument("--elo0", type=float, default=0.0)
+    parser.add_argument("--elo1", type=float, default=5.0)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--max-games", type=int, default=DEFAULT_MAX_GAMES)
+    parser.add_argument("--checkpoint", help="progress file; given alone, resumes the test in it")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--openings", help="file with one FEN per line")
+    parser.add_argument("--random-plies", type=int, default=DEFAULT_RANDOM_PLIES)
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.a is None and args.b is None:
+        if args.checkpoint is None or not os.path.exists(args.checkpoint):
+            parser.error("give --a and --b, or the --checkpoint of a test to resume")
+        run = SPRTRun.resume(args.checkpoint)
+    elif args.a is None or args.b is None:
+        parser.error("give both --a and --b")
+    elif args.checkpoint is not None and os.path.exists(args.checkpoint):
+        parser.error(f"{args.checkpoint} exists, resume it with --checkpoint alone")
+    else:
+        options = {"workers": args.workers, "random_plies": args.random_plies, "max_plies": args.max_plies,
+                   "seed": args.seed}
+        if args.openings:
+            options["openings"] = read_openings(args.openings)
+        run = SPRTRun(read_config(args.a), read_config(args.b), SPRT(args.elo0, args.elo1, args.alpha, args.beta),
+                      args.checkpoint, args.max_games, options)
+    result = run.run()
+    print(run.sprt.report(run.summary))
+    print({H1: "H1 accepted, A is stronger", H0: "H0 accepted, A is not stronger",
+           None: "no decision within max games"}[result])
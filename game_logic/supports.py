@@ -41,6 +41,30 @@ BLACK_PALACE_AREA = (Vector(3,7),Vector(5,9))
 BLACK_HALF = (Vector(0,5),Vector(8,9))
 RED_HALF = (Vector(0,0),Vector(8,4))
 
+# Flat board: square index = y * BOARD_WIDTH + x
+BOARD_WIDTH = 9
+BOARD_HEIGHT = 10
+BOARD_SIZE = BOARD_WIDTH * BOARD_HEIGHT
+
+# Shared, never mutated Vector per square, so converting squares back to Vectors allocates nothing
+SQUARE_VECTORS = [Vector(sq % BOARD_WIDTH, sq // BOARD_WIDTH) for sq in range(BOARD_SIZE)]
+
+def square_of(position: Vector) -> int:
+    return position.y * BOARD_WIDTH + position.x
+
+# Piece codes stored in Board.cells: positive for RED, negative for BLACK
+EMPTY = 0
+GENERAL = 1
+ADVISOR = 2
+ELEPHANT = 3
+HORSE = 4
+CHARIOT = 5
+CANNON = 6
+SOLDIER = 7
+
+# Moves are packed into ints below 1 << 14: move = from_square << 7 | to_square,
+# from_square = move >> 7, to_square = move & 127. Search code inlines the shifts.
+
 
 from typing import List
 
@@ -68,14 +92,18 @@ class Move:
 
 class EvaluateSet:
     
-    def __init__(self, value_multiplier=10, attack_bonus=1, mobility_multiplier=1, control_multiplier=1):
+    def __init__(self, value_multiplier=10, attack_bonus=1, mobility_multiplier=1, control_multiplier=1, position_multiplier=0,
+                 piece_values=None):
         self.value_multiplier = value_multiplier
         self.attack_bonus = attack_bonus
         self.mobility_multiplier = mobility_multiplier
         self.control_multiplier = control_multiplier
+        self.position_multiplier = position_multiplier
+        # {piece code: value} of every kind, replacing the values in pieces.py for material, None = those (see tuning)
+        self.piece_values = piece_values
     
     def get(self):
-        return (self.value_multiplier, self.attack_bonus, self.mobility_multiplier, self.control_multiplier)
+        return (self.value_multiplier, self.attack_bonus, self.mobility_multiplier, self.control_multiplier, self.position_multiplier)
 
 from enum import Enum
 
@@ -91,6 +119,9 @@ class Color(Enum):
     def opposite(self):
         return Color.RED if self == Color.BLACK else Color.BLACK
 
+    def sign(self):
+        return 1 if self == Color.RED else -1
+
 class GameResult(Enum):
     tie = 0
     red_won = 1
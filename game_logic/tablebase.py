@@ -0,0 +1,365 @@
+"""
+Endgame tablebases: distance to mate of every position of a small piece set, generated by
+retrograde analysis and probed from memory-mapped files.
+
+A table is named by its material, RED then BLACK in FEN letters, e.g. KRvKAA or KNPvK, and
+holds one byte per (placement, side to move): 0 draw, INVALID, otherwise plies + 1 where even
+plies mean the side to move is mated in that many plies (0 = no legal move, which loses in
+Xiangqi) and odd plies mean it mates in that many. The colour-swapped set (KAAvKR) is probed
+through the same file with the board mirrored. Repetition rules are not modelled.
+
+    python tablebase.py generate KRvKAA KNPvK --dir tablebases
+    python tablebase.py probe "4k4/4a4/9/9/9/9/9/9/4A4/R3K4 w" --dir tablebases
+"""
+import argparse
+import mmap
+import os
+import struct
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+from board import Board
+from supports import (Color, BOARD_WIDTH, BOARD_HEIGHT, BOARD_SIZE, EMPTY, GENERAL, HORSE, CHARIOT, CANNON,
+                      SOLDIER, SQUARE_VECTORS)
+from move_tables import LEAPER_MOVES
+from fen import parse_fen, START_FEN, PIECE_LETTERS, LETTER_CODES, PIECE_CLASSES
+
+MAGIC = b"XQTB0001"
+HEADER = struct.Struct("<8s16sI")
+EXTENSION = ".xtb"
+DRAW = 0
+INVALID = 255
+MAX_PLIES = INVALID - 2
+ATTACKERS = (HORSE, CHARIOT, CANNON, SOLDIER)
+
+# (signed piece code, square) of every piece of a position
+PiecePlacement = List[Tuple[int, int]]
+
+def _domains() -> List[List[int]]:
+    """Squares each signed piece code can ever stand on: the start squares closed under its steps"""
+    board, _ = parse_fen(START_FEN)
+    domains = [[] for _ in range(2 * SOLDIER + 1)]
+    for code in range(-SOLDIER, SOLDIER + 1):
+        if code == EMPTY:
+            continue
+        if abs(code) in (HORSE, CHARIOT, CANNON):
+            domains[code + SOLDIER] = list(range(BOARD_SIZE))
+            continue
+        reached = {square for square in range(BOARD_SIZE) if board.cells[square] == code}
+        frontier = list(reached)
+        while frontier:
+            square = frontier.pop()
+            for target, _ in LEAPER_MOVES[code + SOLDIER][square]:
+                if target not in reached:
+                    reached.add(target)
+                    frontier.append(target)
+        domains[code + SOLDIER] = sorted(reached)
+    return domains
+
+DOMAINS = _domains()
+# DOMAIN_INDEX[code + SOLDIER][square]: position of square in the code's domain, -1 outside it
+DOMAIN_INDEX = [[-1] * BOARD_SIZE for _ in range(2 * SOLDIER + 1)]
+for _code_index, _domain in enumerate(DOMAINS):
+    for _position, _square in enumerate(_domain):
+        DOMAIN_INDEX[_code_index][_square] = _position
+MIRROR = [(BOARD_HEIGHT - 1 - square // BOARD_WIDTH) * BOARD_WIDTH + square % BOARD_WIDTH for square in range(BOARD_SIZE)]
+
+def _slot_order(code: int) -> Tuple[bool, int]:
+    return code < 0, abs(code)
+
+def signature_of(codes: List[int]) -> str:
+    """Table name of a set of signed piece codes"""
+    codes = sorted(codes, key=_slot_order)
+    red = "".join(PIECE_LETTERS[code].upper() for code in codes if code > 0)
+    black = "".join(PIECE_LETTERS[-code].upper() for code in codes if code < 0)
+    return f"{red}v{black}"
+
+def codes_of(signature: str) -> List[int]:
+    """Signed piece codes of a table name, in slot order"""
+    red, black = signature.upper().split("V")
+    codes = [LETTER_CODES[letter.lower()] for letter in red] + [-LETTER_CODES[letter.lower()] for letter in black]
+    if codes.count(GENERAL) != 1 or codes.count(-GENERAL) != 1:
+        raise ValueError(f"{signature}: each side needs one general")
+    return sorted(codes, key=_slot_order)
+
+def mirrored(signature: str) -> str:
+    red, black = signature.split("v")
+    return f"{black}v{red}"
+
+def has_attackers(codes: List[int]) -> bool:
+    """Without horses, chariots, cannons and soldiers neither side can mate"""
+    return any(abs(code) in ATTACKERS for code in codes)
+
+class Table:
+    """Values of one material signature, indexed by placement and side to move"""
+    def __init__(self, signature: str, values=None):
+        self.signature = signature
+        self.codes = codes_of(signature)
+        self.radices = [len(DOMAINS[code + SOLDIER]) for code in self.codes]
+        self.placements = 1
+        for radix in self.radices:
+            self.placements *= radix
+        self.values = values
+
+    def index(self, pieces: PiecePlacement, red_to_move: bool) -> Optional[int]:
+        """Index of a placement given in slot order, None when a piece stands outside its domain"""
+        index = 0
+        for (code, square), radix in zip(pieces, self.radices):
+            position = DOMAIN_INDEX[code + SOLDIER][square]
+            if position < 0:
+                return None
+            index = index * radix + position
+        return index * 2 + (0 if red_to_move else 1)
+
+    def squares(self, placement: int) -> List[int]:
+        squares = []
+        for code, radix in zip(reversed(self.codes), reversed(self.radices)):
+            squares.append(DOMAINS[code + SOLDIER][placement % radix])
+            placement //= radix
+        squares.reverse()
+        return squares
+
+    def value(self, pieces: PiecePlacement, red_to_move: bool) -> int:
+        index = self.index(pieces, red_to_move)
+        return INVALID if index is None else self.values[index]
+
+class Tablebases:
+    """The tables of a directory, opened through mmap on first use"""
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.tables: Dict[str, Table] = {}
+        self.files = []
+        self.max_pieces = 0
+        self.hits = 0
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(EXTENSION):
+                    signature = name[:-len(EXTENSION)]
+                    self.max_pieces = max(self.max_pieces, len(codes_of(signature)))
+                    self.tables[signature] = None
+
+    def __reduce__(self):
+        # a worker process maps the files itself
+        return Tablebases, (self.directory,)
+
+    def table(self, signature: str) -> Optional[Table]:
+        if signature not in self.tables:
+            return None
+        table = self.tables[signature]
+        if table is None:
+            table = self.tables[signature] = self._open(signature)
+        return table
+
+    def _open(self, signature: str) -> Table:
+        f = open(os.path.join(self.directory, signature + EXTENSION), "rb")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.files.append((f, data))
+        magic, name, placements = HEADER.unpack_from(data, 0)
+        table = Table(signature, memoryview(data)[HEADER.size:])
+        if magic != MAGIC or name.rstrip(b"\0").decode() != signature or placements != table.placements:
+            raise ValueError(f"{signature}{EXTENSION} is not a tablebase of {signature}")
+        return table
+
+    def close(self):
+        # the tables' views of the maps have to go before the maps can close
+        for table in self.tables.values():
+            if table is not None:
+                table.values.release()
+        for f, data in self.files:
+            data.close()
+            f.close()
+        self.files = []
+        self.tables = dict.fromkeys(self.tables)
+
+    def lookup(self, pieces: PiecePlacement, red_to_move: bool) -> Optional[int]:
+        """Stored byte of a position, DRAW without attackers, None when no table covers it"""
+        codes = [code for code, _ in pieces]
+        if not has_attackers(codes):
+            return DRAW
+        signature = signature_of(codes)
+        table = self.table(signature)
+        if table is None:
+            table = self.table(mirrored(signature))
+            if table is None:
+                return None
+            pieces = [(-code, MIRROR[square]) for code, square in pieces]
+            red_to_move = not red_to_move
+        pieces = sorted(pieces, key=lambda piece: _slot_order(piece[0]))
+        value = table.value(pieces, red_to_move)
+        return None if value == INVALID else value
+
+    def probe(self, board: Board, red_to_move: bool) -> Optional[int]:
+        """Stored byte of the position (see result_of), None when no table covers it"""
+        if len(board.reds) + len(board.blacks) > self.max_pieces:
+            return None
+        value = self.lookup([(piece.get_code(), piece.square) for piece in board.reds + board.blacks], red_to_move)
+        if value is not None:
+            self.hits += 1
+        return value
+
+def result_of(value: int) -> Tuple[int, int]:
+    """(1 win / 0 draw / -1 loss for the side to move, plies to mate) of a stored byte"""
+    if value == DRAW:
+        return 0, 0
+    plies = value - 1
+    return (1 if plies % 2 else -1), plies
+
+def generate(signature: str, directory: str, verbose: bool = True) -> Table:
+    """
+    Writes the table of signature to directory, first generating the smaller tables that
+    captures lead into. Returns the table.
+    """
+    bases = Tablebases(directory)
+    if bases.table(signature) is not None:
+        return bases.table(signature)
+    codes = codes_of(signature)
+    for captured in set(code for code in codes if abs(code) != GENERAL):
+        rest = list(codes)
+        rest.remove(captured)
+        sub = signature_of(rest)
+        if has_attackers(rest) and bases.table(sub) is None and bases.table(mirrored(sub)) is None:
+            generate(sub, directory, verbose)
+    bases = Tablebases(directory)
+
+    start = time.perf_counter()
+    table = Table(signature)
+    size = table.placements * 2
+    values = bytearray([INVALID]) * size
+    # in-table successors of each position (CSR), and what the moves out of the table give
+    offsets = array("I", [0]) * (size + 1)
+    successors = array("I")
+    remaining = array("H", [0]) * size
+    can_lose = bytearray(size)
+    longest_loss = array("h", [-1]) * size
+    buckets: List[List[int]] = [[] for _ in range(MAX_PLIES + 2)]
+    classes = [PIECE_CLASSES[abs(code)] for code in codes]
+    colors = [Color.RED if code > 0 else Color.BLACK for code in codes]
+
+    for placement in range(table.placements):
+        squares = table.squares(placement)
+        for side in (0, 1):
+            offsets[placement * 2 + side + 1] = offsets[placement * 2 + side]
+        if len(set(squares)) < len(squares):
+            continue
+        board = Board()
+        board.set_up([piece_class(color, SQUARE_VECTORS[square])
+                      for piece_class, color, square in zip(classes, colors, squares)])
+        slot_of = {square: slot for slot, square in enumerate(squares)}
+        for side, color in enumerate((Color.RED, Color.BLACK)):
+            index = placement * 2 + side
+            if board.in_check(color.opposite()):
+                continue
+            values[index] = DRAW
+            moves = board.generate_legal_moves(color)
+            count = 0
+            lose = 1
+            loss_plies = -1
+            win_plies = None
+            for move in moves:
+                from_sq = move >> 7
+                to_sq = move & 127
+                moved = slot_of[from_sq]
+                if board.cells[to_sq] == EMPTY:
+                    pieces = [(code, to_sq if slot == moved else square)
+                              for slot, (code, square) in enumerate(zip(codes, squares))]
+                    successors.append(table.index(pieces, side == 1))
+                    count += 1
+                    continue
+                captured = slot_of[to_sq]
+                pieces = [(code, to_sq if slot == moved else square)
+                          for slot, (code, square) in enumerate(zip(codes, squares)) if slot != captured]
+                value = bases.lookup(pieces, side == 1)
+                if value is None:
+                    raise ValueError(f"No table for {signature_of([code for code, _ in pieces])}")
+                result, plies = result_of(value)
+                if result == 0:
+                    lose = 0
+                elif result < 0:
+                    lose = 0
+                    if win_plies is None or plies + 1 < win_plies:
+                        win_plies = plies + 1
+                else:
+                    loss_plies = max(loss_plies, plies)
+            offsets[index + 1] = offsets[index] + count
+            remaining[index] = count
+            can_lose[index] = lose
+            longest_loss[index] = loss_plies
+            if win_plies is not None:
+                buckets[win_plies].append(index)
+            elif count == 0 and lose:
+                buckets[loss_plies + 1].append(index)
+    if verbose:
+        print(f"{signature}: {size} positions, {len(successors)} moves, {time.perf_counter() - start:.1f}s")
+
+    # predecessors (reverse CSR)
+    predecessor_offsets = array("I", [0]) * (size + 1)
+    for successor in successors:
+        predecessor_offsets[successor + 1] += 1
+    for index in range(size):
+        predecessor_offsets[index + 1] += predecessor_offsets[index]
+    fill = array("I", predecessor_offsets)
+    predecessors = array("I", [0]) * len(successors)
+    for index in range(size):
+        for edge in range(offsets[index], offsets[index + 1]):
+            successor = successors[edge]
+            predecessors[fill[successor]] = index
+            fill[successor] += 1
+    del successors, fill
+
+    # retrograde: positions leave the buckets in order of plies, so the first value set is the shortest
+    # win, and a loss is set once its last move turns out losing, at the longest of them
+    resolved = bytearray(size)
+    for plies in range(MAX_PLIES + 1):
+        bucket = buckets[plies]
+        while bucket:
+            index = bucket.pop()
+            if resolved[index]:
+                continue
+            resolved[index] = 1
+            values[index] = plies + 1
+            for edge in range(predecessor_offsets[index], predecessor_offsets[index + 1]):
+                predecessor = predecessors[edge]
+                if resolved[predecessor]:
+                    continue
+                if plies % 2 == 0:
+                    if plies + 1 <= MAX_PLIES:
+                        buckets[plies + 1].append(predecessor)
+                else:
+                    remaining[predecessor] -= 1
+                    if not remaining[predecessor] and can_lose[predecessor]:
+                        loss = max(plies, longest_loss[predecessor]) + 1
+                        if loss <= MAX_PLIES:
+                            buckets[loss].append(predecessor)
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, signature + EXTENSION), "wb") as f:
+        f.write(HEADER.pack(MAGIC, signature.encode(), table.placements))
+        f.write(values)
+    if verbose:
+        wins = sum(1 for value in values if value not in (DRAW, INVALID) and value % 2 == 0)
+        print(f"{signature}: written, {wins} winning positions, {time.perf_counter() - start:.1f}s")
+    table.values = values
+    return table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Xiangqi endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="generate tables and the tables they depend on")
+    build.add_argument("signatures", nargs="+", help="material, e.g. KRvKAA")
+    build.add_argument("--dir", default="tablebases")
+    probe = commands.add_parser("probe", help="value of a position")
+    probe.add_argument("fen")
+    probe.add_argument("--dir", default="tablebases")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        for name in args.signatures:
+            generate(name, args.dir)
+    else:
+        board, color = parse_fen(args.fen)
+        value = Tablebases(args.dir).probe(board, color == Color.RED)
+        if value is None:
+            print("not in the tablebases")
+        else:
+            result, plies = result_of(value)
+            print("draw" if result == 0 else f"{color.name} {'mates' if result > 0 else 'is mated'} in {plies} plies")
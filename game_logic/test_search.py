@@ -0,0 +1,59 @@
+import math
+from engine import Engine, TABLEBASE_WIN
+from fen import parse_fen
+from supports import EvaluateSet, square_of
+from tablebase import Tablebases, generate
+
+# mates in one: the chariot closes the last rank, the other chariot holds the second one
+RED_MATE = "4k4/R8/9/9/9/9/9/9/9/3K4R w - - 0 1"
+BLACK_MATE = "3k4r/9/9/9/9/9/9/9/r8/4K4 b - - 0 1"
+
+def packed(move) -> int:
+    return (square_of(move[0]) << 7) | square_of(move[1])
+
+def test_search_root_returns_the_mate_score():
+    for fen, mate, move in ((RED_MATE, math.inf, 8 << 7 | 89), (BLACK_MATE, -math.inf, 89 << 7 | 8)):
+        # deeper, longer forced mates score the same and may be picked instead
+        for depth in (1, 2, 3):
+            board, color = parse_fen(fen)
+            engine = Engine(EvaluateSet(), depth=depth)
+            engine.start_search(board, None, None)
+            moves = board.generate_legal_moves(color)
+            value, best_move, _ = engine.search_root(board, color, moves, depth, False)
+            assert value == mate
+            assert best_move == move
+
+def test_mate_found_after_a_better_first_move():
+    # the first move raising alpha is the mate, the value must not stay at -inf
+    board, color = parse_fen("3k5/9/9/9/9/9/9/9/9/R3K4 w - - 0 1")
+    value, best_move = Engine(EvaluateSet(), depth=4).get_best_move(board, color)
+    assert value == math.inf
+    board.make_move(*divmod(packed(best_move), 128))
+    assert not board.generate_legal_moves(color.opposite())
+
+def test_iterative_deepening_keeps_the_mate():
+    for fen, mate in ((RED_MATE, math.inf), (BLACK_MATE, -math.inf), ("3k5/9/9/9/9/9/9/9/9/R3K4 w - - 0 1", math.inf)):
+        for depth in (3, 4, 5):
+            board, color = parse_fen(fen)
+            engine = Engine(EvaluateSet(), depth=depth)
+            value, best_move = engine.get_best_move(board, color)
+            assert value == mate
+            assert all(iteration[3] == mate for iteration in engine.iterations)
+            board.make_move(*divmod(packed(best_move), 128))
+            assert not board.generate_legal_moves(color.opposite())
+
+def test_tablebase_scores_keep_their_distance_in_the_transposition_table(tmp_path):
+    generate("KRvK", str(tmp_path), verbose=False)
+    tablebases = Tablebases(str(tmp_path))
+    # RED mates in 3 plies
+    fen = "3k5/9/9/9/9/9/9/9/R8/5K3 w - - 0 1"
+    engine = Engine(EvaluateSet(), depth=3, tablebases=tablebases)
+    assert engine.search(*parse_fen(fen))[0] == TABLEBASE_WIN - 3
+    # the same position two plies below the root of the next search, the mate is two plies further
+    for searcher in (engine, Engine(EvaluateSet(), depth=3, tablebases=tablebases)):
+        board, _ = parse_fen(fen)
+        searcher.start_search(board, None, None)
+        board.make_null_move()
+        board.make_null_move()
+        assert searcher.minimax_wrapper(board, 3, True, -math.inf, math.inf) == TABLEBASE_WIN - 5
+    tablebases.close()
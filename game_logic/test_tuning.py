@@ -0,0 +1,20 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from batch_eval import encode_boards, evaluate_exact, features, random_positions
+from supports import EvaluateSet
+from tuning import design_matrix, parameters_of
+
+def test_tuner_model_is_the_evaluation():
+    boards = random_positions(200, seed=3)
+    cells = encode_boards(boards)
+    for eval_set in (EvaluateSet(), EvaluateSet(control_multiplier=0),
+                     EvaluateSet(value_multiplier=10, attack_bonus=3, mobility_multiplier=2, control_multiplier=0)):
+        matrix = design_matrix(eval_set.value_multiplier, eval_set.control_multiplier != 0)
+        predicted = features(cells) @ matrix @ parameters_of(eval_set)
+        expected = evaluate_exact(cells, eval_set)
+        finite = np.isfinite(expected)
+        assert finite.any()
+        assert np.allclose(predicted[finite], expected[finite])
+        assert np.allclose(expected[finite], [board.evaluate(eval_set) for board, keep in zip(boards, finite) if keep])
@@ -0,0 +1,68 @@
+from typing import Optional, Tuple
+
+EXACT = 0
+LOWER = 1   # score is a lower bound: search failed high
+UPPER = 2   # score is an upper bound: search failed low
+
+# rough size of one stored entry in CPython: list slot + tuple + its ints
+ENTRY_BYTES = 160
+
+class TranspositionTable:
+    """
+    Fixed-size hash table of search results keyed by Zobrist hash.
+    Entry = (key, depth, bound, score, best_move, generation).
+
+    Replacement: a slot is overwritten by the same position, by a search of at least
+    the stored depth, or when the stored entry is left from an earlier search (generation).
+    """
+    def __init__(self, size_mb: float = 16):
+        entries = max(1, int(size_mb * 1024 * 1024) // ENTRY_BYTES)
+        size = 1
+        while size * 2 <= entries:
+            size *= 2
+        self.size = size
+        self.mask = size - 1
+        self.entries = [None] * size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 255
+        self.probes = 0
+        self.hits = 0
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.generation = 0
+
+    def probe(self, key: int) -> Optional[Tuple[int, int, float, Optional[int]]]:
+        """Returns (depth, bound, score, best_move) or None"""
+        self.probes += 1
+        entry = self.entries[key & self.mask]
+        if entry is None or entry[0] != key:
+            return None
+        self.hits += 1
+        return entry[1], entry[2], entry[3], entry[4]
+
+    def store(self, key: int, depth: int, bound: int, score: float, best_move: Optional[int]):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is not None:
+            if entry[0] == key:
+                if best_move is None:
+                    best_move = entry[4]
+            elif entry[1] > depth and entry[5] == self.generation:
+                return
+        self.entries[index] = (key, depth, bound, score, best_move, self.generation)
+
+    def get_move(self, key: int) -> Optional[int]:
+        entry = self.entries[key & self.mask]
+        if entry is None or entry[0] != key:
+            return None
+        return entry[4]
+
+    def usage(self) -> float:
+        """Share of slots filled during the current search"""
+        sample = self.entries[:min(self.size, 1000)]
+        return sum(1 for entry in sample if entry is not None and entry[5] == self.generation) / len(sample)
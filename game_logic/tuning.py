@@ -0,0 +1,198 @@
+"""
+Texel tuning of the evaluation: fits the EvaluateSet weights and the piece values so that
+sigmoid(K * score) predicts the results of the games the corpus positions come from.
+
+Corpus: one position per line, "FEN | result" with the result from RED's view: 1-0, 0-1,
+1/2-1/2 or a number 1 / 0.5 / 0. Quiet positions (no capture pending) tune best.
+The corpus is read once in chunks into a float32 cache of batch_eval.features, every
+iteration then streams the cache, so the corpus never has to fit in memory.
+
+    python tuning.py games.txt tuned.json --iterations 300
+    python tuning.py games.txt tuned.json --start tuned.json     # continue from a tuned set
+
+Needs numpy (see batch_eval). The output is read back by evaluation.load_eval_set.
+"""
+import argparse
+import json
+import os
+import time
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+from supports import EvaluateSet, GENERAL
+from fen import PIECE_CLASSES
+from evaluation import save_eval_set, load_eval_set
+from batch_eval import (FEATURES, KINDS, ATTACKERS, MOBILITY, POSITION, CONTROL, CONTROL_OCCUPIED,
+                        encode_fens, features, piece_values)
+
+# tuned parameters: the piece values (the general's is fixed, both sides always have one), then the weights
+TUNED_KINDS = tuple(kind for kind in KINDS if kind != GENERAL)
+PARAMETERS = tuple(PIECE_CLASSES[kind].__name__.lower() for kind in TUNED_KINDS) + \
+             ("attack_bonus", "mobility_multiplier", "control_multiplier", "position_multiplier")
+# cache rows: the features, then the result
+CACHE_COLUMNS = len(FEATURES) + 1
+RESULTS = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}
+# corpus lines and cache rows handled at once
+READ_CHUNK = 65536
+CACHE_CHUNK = 1 << 18
+
+def parse_line(line: str) -> Tuple[str, float]:
+    """'FEN | result' -> (FEN, result for RED)"""
+    fen, result = line.rsplit("|", 1)
+    result = result.strip()
+    value = RESULTS[result] if result in RESULTS else float(result)
+    if not 0 <= value <= 1:
+        raise ValueError(f"Result out of range: {line}")
+    return fen.strip(), value
+
+def read_corpus(path: str, chunk: int = READ_CHUNK) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """(FENs, results) of up to chunk lines at a time"""
+    fens = []
+    results = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fen, result = parse_line(line)
+            fens.append(fen)
+            results.append(result)
+            if len(fens) == chunk:
+                yield fens, np.array(results)
+                fens = []
+                results = []
+    if fens:
+        yield fens, np.array(results)
+
+def build_cache(corpus: str, cache: str, verbose: bool = True) -> int:
+    """Writes the features and results of the corpus to cache, returns the positions kept"""
+    start = time.perf_counter()
+    positions = 0
+    with open(cache, "wb") as f:
+        for fens, results in read_corpus(corpus):
+            cells = encode_fens(fens)
+            # a position without a general is over, it says nothing about the weights
+            kept = (cells == GENERAL).any(axis=1) & (cells == -GENERAL).any(axis=1)
+            rows = np.column_stack((features(cells[kept]), results[kept])).astype(np.float32)
+            f.write(rows.tobytes())
+            positions += len(rows)
+            if verbose:
+                print(f"{positions} positions, {time.perf_counter() - start:.1f}s")
+    return positions
+
+def open_cache(cache: str) -> np.ndarray:
+    rows = os.path.getsize(cache) // (4 * CACHE_COLUMNS)
+    return np.memmap(cache, dtype=np.float32, mode="r", shape=(rows, CACHE_COLUMNS))
+
+def design_matrix(value_multiplier: float, control: bool = True) -> np.ndarray:
+    """
+    (features, parameters): score = features @ design_matrix @ parameters, as in batch_eval.weights
+    params: control: the control terms count, Board.evaluate leaves both out when control_multiplier is 0
+    """
+    matrix = np.zeros((len(FEATURES), len(PARAMETERS)))
+    for index, kind in enumerate(TUNED_KINDS):
+        matrix[KINDS.index(kind), index] = value_multiplier
+    weights = len(TUNED_KINDS)
+    matrix[ATTACKERS, weights] = 1
+    matrix[MOBILITY, weights + 1] = 1
+    matrix[POSITION, weights + 3] = 1
+    if control:
+        matrix[CONTROL_OCCUPIED, weights] = 1
+        matrix[CONTROL, weights + 2] = 1
+    return matrix
+
+def parameters_of(eval_set: EvaluateSet) -> np.ndarray:
+    values = piece_values(eval_set)
+    return np.array([values[KINDS.index(kind)] for kind in TUNED_KINDS] +
+                    [eval_set.attack_bonus, eval_set.mobility_multiplier, eval_set.control_multiplier,
+                     eval_set.position_multiplier], dtype=float)
+
+def eval_set_of(parameters: np.ndarray, value_multiplier: float, general_value: float) -> EvaluateSet:
+    values = {GENERAL: general_value}
+    values.update({kind: float(value) for kind, value in zip(TUNED_KINDS, parameters)})
+    weights = parameters[len(TUNED_KINDS):]
+    return EvaluateSet(value_multiplier, float(weights[0]), float(weights[1]), float(weights[2]), float(weights[3]),
+                       piece_values=values)
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-x))
+
+def loss(rows: np.ndarray, matrix: np.ndarray, parameters: np.ndarray, k: float,
+         gradient: bool = True) -> Tuple[float, Optional[np.ndarray]]:
+    """Mean squared error of sigmoid(K * score) against the results, and its gradient by the parameters"""
+    total = 0.0
+    grad = np.zeros(len(parameters)) if gradient else None
+    weights = (matrix @ parameters).astype(np.float32)
+    for start in range(0, len(rows), CACHE_CHUNK):
+        chunk = rows[start:start + CACHE_CHUNK]
+        x = chunk[:, :-1]
+        predicted = _sigmoid(k * (x @ weights))
+        error = predicted - chunk[:, -1]
+        total += float(error @ error)
+        if gradient:
+            grad += matrix.T @ (x.T @ (error * predicted * (1 - predicted))).astype(float)
+    count = max(len(rows), 1)
+    if gradient:
+        grad *= 2 * k / count
+    return total / count, grad
+
+def fit_k(rows: np.ndarray, matrix: np.ndarray, parameters: np.ndarray, low: float = 1e-4, high: float = 1.0,
+          steps: int = 40) -> float:
+    """Scale of the sigmoid that fits the results best with the starting weights, golden section search"""
+    ratio = (5 ** 0.5 - 1) / 2
+    low = np.log(low)
+    high = np.log(high)
+    for _ in range(steps):
+        a = high - ratio * (high - low)
+        b = low + ratio * (high - low)
+        if loss(rows, matrix, parameters, np.exp(a), False)[0] < loss(rows, matrix, parameters, np.exp(b), False)[0]:
+            high = b
+        else:
+            low = a
+    return float(np.exp((low + high) / 2))
+
+def tune(rows: np.ndarray, eval_set: EvaluateSet, iterations: int = 300, learning_rate: float = 0.05,
+         verbose: bool = True) -> Tuple[EvaluateSet, float, float]:
+    """
+    Adam on the full cache every iteration, value_multiplier stays as in eval_set,
+    and so does a control_multiplier of 0 (the control terms are off then).
+    Returns (tuned set, K, final loss)
+    """
+    matrix = design_matrix(eval_set.value_multiplier, eval_set.control_multiplier != 0)
+    parameters = parameters_of(eval_set)
+    k = fit_k(rows, matrix, parameters)
+    first = second = np.zeros(len(parameters))
+    beta1 = 0.9
+    beta2 = 0.999
+    start = time.perf_counter()
+    for iteration in range(1, iterations + 1):
+        error, grad = loss(rows, matrix, parameters, k)
+        first = beta1 * first + (1 - beta1) * grad
+        second = beta2 * second + (1 - beta2) * grad * grad
+        step = first / (1 - beta1 ** iteration) / (np.sqrt(second / (1 - beta2 ** iteration)) + 1e-12)
+        parameters = parameters - learning_rate * step
+        if verbose and (iteration % 25 == 0 or iteration == 1):
+            print(f"iteration {iteration}: loss {error:.6f}, {time.perf_counter() - start:.1f}s")
+    general_value = piece_values(eval_set)[KINDS.index(GENERAL)]
+    tuned = eval_set_of(parameters, eval_set.value_multiplier, general_value)
+    return tuned, k, loss(rows, matrix, parameters, k, False)[0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Texel tuning of the evaluation weights")
+    parser.add_argument("corpus", help="'FEN | result' per line")
+    parser.add_argument("output", help="tuned EvaluateSet, JSON")
+    parser.add_argument("--cache", help="feature cache, default corpus + '.features'; reused when newer than the corpus")
+    parser.add_argument("--start", help="EvaluateSet JSON to start from, default EvaluateSet()")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--learning-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    cache = args.cache or args.corpus + ".features"
+    if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(args.corpus):
+        build_cache(args.corpus, cache)
+    rows = open_cache(cache)
+    start = load_eval_set(args.start) if args.start else EvaluateSet()
+    tuned, k, final = tune(rows, start, args.iterations, args.learning_rate)
+    save_eval_set(args.output, tuned, k=k, loss=final, positions=len(rows))
+    print(f"{args.output}: loss {final:.6f} over {len(rows)} positions, K {k:.5f}")
+    with open(args.output) as f:
+        for name, value in json.load(f).items():
+            print(f"  {name}: {value}")
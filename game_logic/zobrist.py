@@ -0,0 +1,16 @@
+import random
+from supports import BOARD_SIZE, SOLDIER
+
+# Fixed seed: hashes must be identical across runs and processes
+_rng = random.Random(0x5A0B1157)
+
+# PIECE_KEYS[code + SOLDIER][square], code is a signed piece code from supports
+PIECE_KEYS = [[_rng.getrandbits(64) for _ in range(BOARD_SIZE)] for _ in range(2 * SOLDIER + 1)]
+# Board.hash only describes placement; searches mix this in when BLACK is to move
+BLACK_TO_MOVE = _rng.getrandbits(64)
+
+def piece_key(code: int, square: int) -> int:
+    return PIECE_KEYS[code + SOLDIER][square]
+
+def side_key(hash_value: int, red_to_move: bool) -> int:
+    return hash_value if red_to_move else hash_value ^ BLACK_TO_MOVE